@@ -0,0 +1,283 @@
+"""Benchmark de get-near-stores em escala de cidade.
+
+Popula um DynamoDB local (moto em memória, ou DynamoDB Local com
+--endpoint-url) com endereços e vendedores sintéticos, sobe um servidor
+HTTP local no lugar da API de CEP e mede o lambda_handler:
+latência p50/p95, chamadas ao DynamoDB e chamadas HTTP externas por
+requisição.
+
+Uso:
+    python Benchmarks/bench_get_near_stores.py --addresses 10000 --requests 200
+    python Benchmarks/bench_get_near_stores.py --addresses 200000 --endpoint-url http://localhost:8000
+"""
+import argparse
+import importlib.util
+import json
+import os
+import random
+import statistics
+import threading
+import time
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+HANDLER_PATH = os.path.join(os.path.dirname(__file__), '..', 'Microservices', 'Address', 'Logic', 'get-near-stores.py')
+
+CITY_CENTER = (-23.55, -46.63)
+CITY_SPREAD_DEGREES = 0.15
+
+ADDRESS_TABLE = 'bench_Loja_Endereco'
+USER_TABLE = 'bench_Usuario'
+
+CEP_COORDINATES = {}
+HTTP_CALLS = {'total': 0}
+DYNAMODB_CALLS = {'total': 0}
+
+
+class FakeCepHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        HTTP_CALLS['total'] += 1
+        cep = self.path.rstrip('/').split('/')[-1]
+        coordinates = CEP_COORDINATES.get(cep)
+
+        if coordinates is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        body = json.dumps({'cep': cep, 'lat': str(coordinates[0]), 'lng': str(coordinates[1])}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fake_cep_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeCepHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def count_dynamodb_calls():
+    from botocore.client import BaseClient
+
+    make_api_call = BaseClient._make_api_call
+
+    def counted_api_call(client, operation_name, api_params):
+        if client.meta.service_model.service_name == 'dynamodb':
+            DYNAMODB_CALLS['total'] += 1
+        return make_api_call(client, operation_name, api_params)
+
+    BaseClient._make_api_call = counted_api_call
+
+
+def create_tables(dynamodb):
+    dynamodb.create_table(
+        TableName=ADDRESS_TABLE,
+        KeySchema=[{'AttributeName': 'id_Endereco', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[
+            {'AttributeName': 'id_Endereco', 'AttributeType': 'N'},
+            {'AttributeName': 'geohash_celula', 'AttributeType': 'S'},
+            {'AttributeName': 'geohash', 'AttributeType': 'S'}
+        ],
+        GlobalSecondaryIndexes=[{
+            'IndexName': 'geohash_celula-index',
+            'KeySchema': [
+                {'AttributeName': 'geohash_celula', 'KeyType': 'HASH'},
+                {'AttributeName': 'geohash', 'KeyType': 'RANGE'}
+            ],
+            'Projection': {'ProjectionType': 'ALL'}
+        }],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    dynamodb.create_table(
+        TableName=USER_TABLE,
+        KeySchema=[{'AttributeName': 'cpf', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[
+            {'AttributeName': 'cpf', 'AttributeType': 'S'},
+            {'AttributeName': 'email', 'AttributeType': 'S'},
+            {'AttributeName': 'fk_id_Endereco', 'AttributeType': 'N'}
+        ],
+        GlobalSecondaryIndexes=[
+            {
+                'IndexName': 'email-index',
+                'KeySchema': [{'AttributeName': 'email', 'KeyType': 'HASH'}],
+                'Projection': {'ProjectionType': 'ALL'}
+            },
+            {
+                'IndexName': 'fk_id_Endereco-index',
+                'KeySchema': [{'AttributeName': 'fk_id_Endereco', 'KeyType': 'HASH'}],
+                'Projection': {'ProjectionType': 'ALL'}
+            }
+        ],
+        BillingMode='PAY_PER_REQUEST'
+    )
+
+
+def seed(dynamodb, handler, args):
+    rng = random.Random(args.seed)
+    address_table = dynamodb.Table(ADDRESS_TABLE)
+    user_table = dynamodb.Table(USER_TABLE)
+
+    customers = []
+    with address_table.batch_writer() as addresses, user_table.batch_writer() as users:
+        for index in range(args.addresses):
+            latitude = round(CITY_CENTER[0] + rng.uniform(-CITY_SPREAD_DEGREES, CITY_SPREAD_DEGREES), 6)
+            longitude = round(CITY_CENTER[1] + rng.uniform(-CITY_SPREAD_DEGREES, CITY_SPREAD_DEGREES), 6)
+            cep = f"{index:08d}"
+            CEP_COORDINATES[cep] = (latitude, longitude)
+
+            address_id = index + 1
+            is_store = index >= args.customers
+            address = {
+                'id_Endereco': address_id,
+                'cep': cep,
+                'logradouro': f"Rua {index}",
+                'numero': str(index % 1000),
+                'complemento': '',
+                'atualizado_em': int(time.time())
+            }
+
+            if rng.random() >= args.legacy_ratio:
+                address['latitude'] = Decimal(str(latitude))
+                address['longitude'] = Decimal(str(longitude))
+
+            if is_store:
+                geohash = handler.encode_geohash(latitude, longitude, 9)
+                address.update({
+                    'nome_Loja': f"Loja {index}",
+                    'descricao_Loja': f"Descrição da loja {index}",
+                    'id_Imagem': f"loja-{index}.jpg",
+                    'tipo_Entrega': 'Entrega feita pelo vendedor',
+                    'access_token': f"TEST-{index}",
+                    'flag_loja': True,
+                    'geohash': geohash,
+                    'geohash_celula': geohash[:handler.GEOHASH_CELL_PRECISION]
+                })
+
+            addresses.put_item(Item=address)
+
+            email = f"usuario{index}@bench.vizinhos"
+            users.put_item(Item={
+                'cpf': f"{index:011d}",
+                'nome': f"Usuário {index}",
+                'email': email,
+                'telefone': '+5511900000000',
+                'Usuario_Tipo': 'seller' if is_store else 'customer',
+                'fk_id_Endereco': address_id
+            })
+
+            if not is_store:
+                customers.append(email)
+
+    return customers
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def run(handler, customers, args):
+    rng = random.Random(args.seed + 1)
+    latencies = []
+    dynamodb_calls = []
+    http_calls = []
+    errors = 0
+
+    query = {'limit': str(args.limit), 'radius': str(args.radius)}
+    if args.k:
+        query['k'] = str(args.k)
+
+    for _ in range(args.requests):
+        event = {'queryStringParameters': {'email': rng.choice(customers), **query}}
+
+        dynamodb_before = DYNAMODB_CALLS['total']
+        http_before = HTTP_CALLS['total']
+        started = time.perf_counter()
+        response = handler.lambda_handler(event, None)
+        latencies.append((time.perf_counter() - started) * 1000)
+        dynamodb_calls.append(DYNAMODB_CALLS['total'] - dynamodb_before)
+        http_calls.append(HTTP_CALLS['total'] - http_before)
+
+        if response['statusCode'] != 200:
+            errors += 1
+
+    return latencies, dynamodb_calls, http_calls, errors
+
+
+def report(label, latencies, dynamodb_calls, http_calls, errors):
+    print(f"\n== {label} ({len(latencies)} requisições, {errors} erros)")
+    print(f"latência p50: {percentile(latencies, 0.50):.2f} ms")
+    print(f"latência p95: {percentile(latencies, 0.95):.2f} ms")
+    print(f"latência máx: {max(latencies):.2f} ms")
+    print(f"DynamoDB por requisição: média {statistics.mean(dynamodb_calls):.2f}, máx {max(dynamodb_calls)}")
+    print(f"HTTP externo por requisição: média {statistics.mean(http_calls):.2f}, máx {max(http_calls)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--addresses', type=int, default=10000, help='total de endereços sintéticos')
+    parser.add_argument('--customers', type=int, default=1000, help='quantos desses endereços são de clientes')
+    parser.add_argument('--requests', type=int, default=200, help='requisições medidas após a primeira')
+    parser.add_argument('--radius', type=float, default=500.0)
+    parser.add_argument('--limit', type=int, default=100)
+    parser.add_argument('--k', type=int, default=None)
+    parser.add_argument('--legacy-ratio', type=float, default=0.0, help='fração de endereços sem latitude/longitude salvas')
+    parser.add_argument('--store-index', choices=['true', 'false'], default='true', help='valor de STORE_INDEX_ENABLED')
+    parser.add_argument('--endpoint-url', default=None, help='endpoint do DynamoDB Local; sem ele usa moto')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    if args.customers >= args.addresses:
+        parser.error('--customers deve ser menor que --addresses')
+
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+    os.environ['ADRESS_STORE_TABLE'] = ADDRESS_TABLE
+    os.environ['TABLE_USER'] = USER_TABLE
+    os.environ['BUCKET_NAME'] = 'bench-bucket'
+    os.environ['STORE_INDEX_ENABLED'] = args.store_index
+    os.environ.pop('CEP_CACHE_TABLE', None)
+
+    server = start_fake_cep_server()
+    os.environ['CEP_COORDINATES_URL'] = f"http://127.0.0.1:{server.server_address[1]}/json"
+
+    mock = None
+    if args.endpoint_url:
+        os.environ['AWS_ENDPOINT_URL_DYNAMODB'] = args.endpoint_url
+    else:
+        from moto import mock_aws
+        mock = mock_aws()
+        mock.start()
+
+    import boto3
+
+    spec = importlib.util.spec_from_file_location('get_near_stores', HANDLER_PATH)
+    handler = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(handler)
+
+    dynamodb = boto3.resource('dynamodb')
+    create_tables(dynamodb)
+
+    started = time.perf_counter()
+    customers = seed(dynamodb, handler, args)
+    print(f"{args.addresses} endereços ({args.addresses - args.customers} lojas) populados em {time.perf_counter() - started:.1f} s")
+
+    count_dynamodb_calls()
+
+    report('primeira requisição', *run(handler, customers, argparse.Namespace(**{**vars(args), 'requests': 1})))
+    report('requisições seguintes', *run(handler, customers, args))
+
+    server.shutdown()
+    if mock:
+        mock.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,26 @@
 import json
 import boto3
 import os
+import time
+
+STORE_CHANGES_TTL_SECONDS = int(os.environ.get('STORE_CHANGES_TTL_SECONDS', str(24 * 60 * 60)))
+
+def record_store_change(address_id: int, removed: bool = False):
+    if not os.environ.get('STORE_CHANGES_TABLE'):
+        return
+    try:
+        now = time.time()
+        boto3.resource('dynamodb').Table(os.environ['STORE_CHANGES_TABLE']).put_item(
+            Item={
+                'particao': 'lojas',
+                'versao': f"{int(now * 1000):013d}#{address_id}",
+                'id_Endereco': address_id,
+                'removida': removed,
+                'expira_em': int(now) + STORE_CHANGES_TTL_SECONDS
+            }
+        )
+    except Exception as ex:
+        print(f"Erro ao registrar alteração da loja {address_id}: {str(ex)}")
 
 def lambda_handler(event:any, context:any):
     try:
@@ -31,6 +51,8 @@ def lambda_handler(event:any, context:any):
         table.delete_item(
             Key={'id_Endereco': address_id}
         )
+        if response['Item'].get('flag_loja'):
+            record_store_change(address_id, removed=True)
 
         return {
             "statusCode": 200,
@@ -50,6 +72,7 @@ def lambda_handler(event:any, context:any):
 
 if __name__ == "__main__":
     os.environ['TABLE_NAME'] = 'Loja_Endereco'
+    os.environ['STORE_CHANGES_TABLE'] = ''
     event = {
         "queryStringParameters": {
             "id_Endereco": ""
@@ -1,8 +1,11 @@
 import json
 import boto3
 import os
+import time
 import re
 import requests
+from collections import OrderedDict
+from decimal import Decimal
 from dataclasses import dataclass
 
 @dataclass
@@ -87,6 +90,168 @@ def validate_cep(cep:str):
     except Exception as ex:
         raise Exception(str(ex))
 
+GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 9
+GEOHASH_CELL_PRECISION = 5
+
+def encode_geohash(latitude: float, longitude: float, precision: int = GEOHASH_PRECISION) -> str:
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    geohash = []
+    bits = 0
+    char_index = 0
+    even = True
+
+    while len(geohash) < precision:
+        coord_range, value = (lng_range, longitude) if even else (lat_range, latitude)
+        mid = (coord_range[0] + coord_range[1]) / 2
+        char_index <<= 1
+        if value >= mid:
+            char_index |= 1
+            coord_range[0] = mid
+        else:
+            coord_range[1] = mid
+
+        even = not even
+        bits += 1
+        if bits == 5:
+            geohash.append(GEOHASH_BASE32[char_index])
+            bits = 0
+            char_index = 0
+
+    return ''.join(geohash)
+
+CEP_CACHE_MAX_SIZE = int(os.environ.get('CEP_CACHE_MAX_SIZE', '2048'))
+CEP_CACHE_TTL_SECONDS = int(os.environ.get('CEP_CACHE_TTL_SECONDS', str(30 * 24 * 60 * 60)))
+CEP_CACHE_NEGATIVE_TTL_SECONDS = int(os.environ.get('CEP_CACHE_NEGATIVE_TTL_SECONDS', str(24 * 60 * 60)))
+CEP_CACHE = OrderedDict()
+CEP_CACHE_STATS = {'hit_memoria': 0, 'hit_dynamodb': 0, 'miss': 0, 'negativo': 0}
+CEP_CACHE_TABLE = None
+
+def get_cep_cache_table():
+    global CEP_CACHE_TABLE
+    if CEP_CACHE_TABLE is None and os.environ.get('CEP_CACHE_TABLE'):
+        CEP_CACHE_TABLE = boto3.resource('dynamodb').Table(os.environ['CEP_CACHE_TABLE'])
+    return CEP_CACHE_TABLE
+
+def remember_cep(cep: str, coordinates, expires_at: float):
+    CEP_CACHE[cep] = (coordinates, expires_at)
+    CEP_CACHE.move_to_end(cep)
+    while len(CEP_CACHE) > CEP_CACHE_MAX_SIZE:
+        CEP_CACHE.popitem(last=False)
+
+def get_cached_cep(cep: str):
+    now = time.time()
+    if cep in CEP_CACHE:
+        coordinates, expires_at = CEP_CACHE[cep]
+        if expires_at > now:
+            CEP_CACHE.move_to_end(cep)
+            CEP_CACHE_STATS['hit_memoria'] += 1
+            return True, coordinates
+        del CEP_CACHE[cep]
+
+    cache_table = get_cep_cache_table()
+    if cache_table is not None:
+        try:
+            item = cache_table.get_item(Key={'cep': cep}).get('Item')
+            if item and int(item['expira_em']) > now:
+                coordinates = None
+                if item.get('valido'):
+                    coordinates = {
+                        'latitude': float(item['latitude']),
+                        'longitude': float(item['longitude'])
+                    }
+                remember_cep(cep, coordinates, int(item['expira_em']))
+                CEP_CACHE_STATS['hit_dynamodb'] += 1
+                return True, coordinates
+        except Exception as ex:
+            print(f"Erro ao consultar cache do CEP {cep}: {str(ex)}")
+
+    CEP_CACHE_STATS['miss'] += 1
+    return False, None
+
+def cache_cep(cep: str, coordinates):
+    ttl = CEP_CACHE_TTL_SECONDS if coordinates else CEP_CACHE_NEGATIVE_TTL_SECONDS
+    expires_at = int(time.time()) + ttl
+    remember_cep(cep, coordinates, expires_at)
+
+    cache_table = get_cep_cache_table()
+    if cache_table is None:
+        return
+
+    item = {'cep': cep, 'valido': coordinates is not None, 'expira_em': expires_at}
+    if coordinates:
+        item['latitude'] = Decimal(str(coordinates['latitude']))
+        item['longitude'] = Decimal(str(coordinates['longitude']))
+
+    try:
+        cache_table.put_item(Item=item)
+    except Exception as ex:
+        print(f"Erro ao salvar cache do CEP {cep}: {str(ex)}")
+
+def get_cep_coordinates(cep: str):
+    found, coordinates = get_cached_cep(cep)
+    if found:
+        return coordinates
+
+    try:
+        response = requests.get(f"https://cep.awesomeapi.com.br/json/{cep}")
+        if response.status_code in (400, 404):
+            CEP_CACHE_STATS['negativo'] += 1
+            cache_cep(cep, None)
+            return None
+        if response.status_code != 200:
+            return None
+
+        data = response.json()
+        coordinates = {
+            'latitude': float(data["lat"]),
+            'longitude': float(data["lng"])
+        }
+
+        cache_cep(cep, coordinates)
+        return coordinates
+    except Exception as ex:
+        print(f"Erro ao buscar coordenadas do CEP {cep}: {str(ex)}")
+        return None
+
+def get_address_location(cep: str, is_store: bool) -> dict:
+    coordinates = get_cep_coordinates(cep)
+    if not coordinates:
+        print(f"Não foi possível obter a localização do CEP {cep}")
+        return {}
+
+    location = {
+        'latitude': Decimal(str(coordinates['latitude'])),
+        'longitude': Decimal(str(coordinates['longitude']))
+    }
+
+    if is_store:
+        geohash = encode_geohash(coordinates['latitude'], coordinates['longitude'])
+        location['geohash'] = geohash
+        location['geohash_celula'] = geohash[:GEOHASH_CELL_PRECISION]
+
+    return location
+
+STORE_CHANGES_TTL_SECONDS = int(os.environ.get('STORE_CHANGES_TTL_SECONDS', str(24 * 60 * 60)))
+
+def record_store_change(address_id: int, removed: bool = False):
+    if not os.environ.get('STORE_CHANGES_TABLE'):
+        return
+    try:
+        now = time.time()
+        boto3.resource('dynamodb').Table(os.environ['STORE_CHANGES_TABLE']).put_item(
+            Item={
+                'particao': 'lojas',
+                'versao': f"{int(now * 1000):013d}#{address_id}",
+                'id_Endereco': address_id,
+                'removida': removed,
+                'expira_em': int(now) + STORE_CHANGES_TTL_SECONDS
+            }
+        )
+    except Exception as ex:
+        print(f"Erro ao registrar alteração da loja {address_id}: {str(ex)}")
+
 def lambda_handler(event:any, context:any):
     try:
         body = json.loads(event['body'])
@@ -95,36 +260,57 @@ def lambda_handler(event:any, context:any):
         dynamodb = boto3.resource('dynamodb')
         address_store_table = dynamodb.Table(os.environ['TABLE_NAME'])
 
-        if 'Item' not in address_store_table.get_item(Key={'id_Endereco': address_store.id_Endereco}):
+        current_address = address_store_table.get_item(Key={'id_Endereco': address_store.id_Endereco}).get('Item')
+        if current_address is None:
             raise ValueError('Endereço não encontrado')
 
-        if body['Usuario_Tipo'] == 'customer':
-            address_store_table.update_item(
-                Key={'id_Endereco': address_store.id_Endereco},
-                UpdateExpression="SET cep = :cep, logradouro = :logradouro, numero = :numero, complemento = :complemento Remove nome_Loja, descricao_Loja, id_Imagem, tipo_Entrega",
-                ExpressionAttributeValues={
-                    ':cep': address_store.cep,
-                    ':logradouro': address_store.logradouro,
-                    ':numero': address_store.numero,
-                    ':complemento': address_store.complemento
-                }
-            )
+        is_store = body['Usuario_Tipo'] != 'customer'
+        cep_changed = current_address.get('cep') != address_store.cep
+        location = {}
+        if cep_changed or 'latitude' not in current_address or (is_store and 'geohash' not in current_address):
+            location = get_address_location(address_store.cep, is_store)
+
+        set_expressions = ["cep = :cep", "logradouro = :logradouro", "numero = :numero", "complemento = :complemento", "atualizado_em = :atualizado_em"]
+        remove_expressions = []
+        expression_values = {
+            ':atualizado_em': int(time.time()),
+            ':cep': address_store.cep,
+            ':logradouro': address_store.logradouro,
+            ':numero': address_store.numero,
+            ':complemento': address_store.complemento
+        }
+
+        if is_store:
+            set_expressions += ["nome_Loja = :nome_Loja", "descricao_Loja = :descricao_Loja", "id_Imagem = :id_Imagem", "tipo_Entrega = :tipo_Entrega", "access_token = :access_token", "flag_loja = :flag_loja"]
+            expression_values.update({
+                ':flag_loja': True,
+                ':nome_Loja': address_store.nome_Loja,
+                ':descricao_Loja': address_store.descricao_Loja,
+                ':id_Imagem': address_store.id_Imagem,
+                ':tipo_Entrega': address_store.tipo_Entrega,
+                ':access_token': address_store.access_token
+            })
         else:
-            address_store_table.update_item(
-                Key={'id_Endereco': address_store.id_Endereco},
-                UpdateExpression="SET cep = :cep, logradouro = :logradouro, numero = :numero, complemento = :complemento, nome_Loja = :nome_Loja, descricao_Loja = :descricao_Loja, id_Imagem = :id_Imagem, tipo_Entrega = :tipo_Entrega, access_token = :access_token",
-                ExpressionAttributeValues={
-                    ':cep': address_store.cep,
-                    ':logradouro': address_store.logradouro,
-                    ':numero': address_store.numero,
-                    ':complemento': address_store.complemento,
-                    ':nome_Loja': address_store.nome_Loja,
-                    ':descricao_Loja': address_store.descricao_Loja,
-                    ':id_Imagem': address_store.id_Imagem,
-                    ':tipo_Entrega': address_store.tipo_Entrega,
-                    ':access_token': address_store.access_token
-                }
-            )
+            remove_expressions += ["nome_Loja", "descricao_Loja", "id_Imagem", "tipo_Entrega", "flag_loja", "geohash", "geohash_celula"]
+
+        for attribute, value in location.items():
+            set_expressions.append(f"{attribute} = :{attribute}")
+            expression_values[f':{attribute}'] = value
+
+        if cep_changed and not location:
+            remove_expressions += [attribute for attribute in ['latitude', 'longitude', 'geohash', 'geohash_celula'] if attribute not in remove_expressions]
+
+        update_expression = "SET " + ", ".join(set_expressions)
+        if remove_expressions:
+            update_expression += " REMOVE " + ", ".join(remove_expressions)
+
+        address_store_table.update_item(
+            Key={'id_Endereco': address_store.id_Endereco},
+            UpdateExpression=update_expression,
+            ExpressionAttributeValues=expression_values
+        )
+        if is_store or current_address.get('flag_loja'):
+            record_store_change(address_store.id_Endereco)
 
         return {
             'statusCode': 200,
@@ -157,6 +343,8 @@ def lambda_handler(event:any, context:any):
 
 if __name__ == "__main__":
     os.environ['TABLE_NAME'] = ''
+    os.environ['CEP_CACHE_TABLE'] = ''
+    os.environ['STORE_CHANGES_TABLE'] = ''
     event = {
         "body": json.dumps({
             "id_Endereco": "",
@@ -0,0 +1,269 @@
+import json
+import boto3
+import os
+import time
+import requests
+from collections import OrderedDict
+from decimal import Decimal
+
+GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 9
+GEOHASH_CELL_PRECISION = 5
+
+def encode_geohash(latitude: float, longitude: float, precision: int = GEOHASH_PRECISION) -> str:
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    geohash = []
+    bits = 0
+    char_index = 0
+    even = True
+
+    while len(geohash) < precision:
+        coord_range, value = (lng_range, longitude) if even else (lat_range, latitude)
+        mid = (coord_range[0] + coord_range[1]) / 2
+        char_index <<= 1
+        if value >= mid:
+            char_index |= 1
+            coord_range[0] = mid
+        else:
+            coord_range[1] = mid
+
+        even = not even
+        bits += 1
+        if bits == 5:
+            geohash.append(GEOHASH_BASE32[char_index])
+            bits = 0
+            char_index = 0
+
+    return ''.join(geohash)
+
+CEP_CACHE_MAX_SIZE = int(os.environ.get('CEP_CACHE_MAX_SIZE', '2048'))
+CEP_CACHE_TTL_SECONDS = int(os.environ.get('CEP_CACHE_TTL_SECONDS', str(30 * 24 * 60 * 60)))
+CEP_CACHE_NEGATIVE_TTL_SECONDS = int(os.environ.get('CEP_CACHE_NEGATIVE_TTL_SECONDS', str(24 * 60 * 60)))
+CEP_CACHE = OrderedDict()
+CEP_CACHE_STATS = {'hit_memoria': 0, 'hit_dynamodb': 0, 'miss': 0, 'negativo': 0}
+CEP_CACHE_TABLE = None
+
+def get_cep_cache_table():
+    global CEP_CACHE_TABLE
+    if CEP_CACHE_TABLE is None and os.environ.get('CEP_CACHE_TABLE'):
+        CEP_CACHE_TABLE = boto3.resource('dynamodb').Table(os.environ['CEP_CACHE_TABLE'])
+    return CEP_CACHE_TABLE
+
+def remember_cep(cep: str, coordinates, expires_at: float):
+    CEP_CACHE[cep] = (coordinates, expires_at)
+    CEP_CACHE.move_to_end(cep)
+    while len(CEP_CACHE) > CEP_CACHE_MAX_SIZE:
+        CEP_CACHE.popitem(last=False)
+
+def get_cached_cep(cep: str):
+    now = time.time()
+    if cep in CEP_CACHE:
+        coordinates, expires_at = CEP_CACHE[cep]
+        if expires_at > now:
+            CEP_CACHE.move_to_end(cep)
+            CEP_CACHE_STATS['hit_memoria'] += 1
+            return True, coordinates
+        del CEP_CACHE[cep]
+
+    cache_table = get_cep_cache_table()
+    if cache_table is not None:
+        try:
+            item = cache_table.get_item(Key={'cep': cep}).get('Item')
+            if item and int(item['expira_em']) > now:
+                coordinates = None
+                if item.get('valido'):
+                    coordinates = {
+                        'latitude': float(item['latitude']),
+                        'longitude': float(item['longitude'])
+                    }
+                remember_cep(cep, coordinates, int(item['expira_em']))
+                CEP_CACHE_STATS['hit_dynamodb'] += 1
+                return True, coordinates
+        except Exception as ex:
+            print(f"Erro ao consultar cache do CEP {cep}: {str(ex)}")
+
+    CEP_CACHE_STATS['miss'] += 1
+    return False, None
+
+def cache_cep(cep: str, coordinates):
+    ttl = CEP_CACHE_TTL_SECONDS if coordinates else CEP_CACHE_NEGATIVE_TTL_SECONDS
+    expires_at = int(time.time()) + ttl
+    remember_cep(cep, coordinates, expires_at)
+
+    cache_table = get_cep_cache_table()
+    if cache_table is None:
+        return
+
+    item = {'cep': cep, 'valido': coordinates is not None, 'expira_em': expires_at}
+    if coordinates:
+        item['latitude'] = Decimal(str(coordinates['latitude']))
+        item['longitude'] = Decimal(str(coordinates['longitude']))
+
+    try:
+        cache_table.put_item(Item=item)
+    except Exception as ex:
+        print(f"Erro ao salvar cache do CEP {cep}: {str(ex)}")
+
+def get_cep_coordinates(cep: str):
+    found, coordinates = get_cached_cep(cep)
+    if found:
+        return coordinates
+
+    try:
+        response = requests.get(f"https://cep.awesomeapi.com.br/json/{cep}")
+        if response.status_code in (400, 404):
+            CEP_CACHE_STATS['negativo'] += 1
+            cache_cep(cep, None)
+            return None
+        if response.status_code != 200:
+            return None
+
+        data = response.json()
+        coordinates = {
+            'latitude': float(data["lat"]),
+            'longitude': float(data["lng"])
+        }
+
+        cache_cep(cep, coordinates)
+        return coordinates
+    except Exception as ex:
+        print(f"Erro ao buscar coordenadas do CEP {cep}: {str(ex)}")
+        return None
+
+def get_address_location(cep: str, is_store: bool) -> dict:
+    coordinates = get_cep_coordinates(cep)
+    if not coordinates:
+        print(f"Não foi possível obter a localização do CEP {cep}")
+        return {}
+
+    location = {
+        'latitude': Decimal(str(coordinates['latitude'])),
+        'longitude': Decimal(str(coordinates['longitude']))
+    }
+
+    if is_store:
+        geohash = encode_geohash(coordinates['latitude'], coordinates['longitude'])
+        location['geohash'] = geohash
+        location['geohash_celula'] = geohash[:GEOHASH_CELL_PRECISION]
+
+    return location
+
+STORE_CHANGES_TTL_SECONDS = int(os.environ.get('STORE_CHANGES_TTL_SECONDS', str(24 * 60 * 60)))
+
+def record_store_change(address_id: int, removed: bool = False):
+    if not os.environ.get('STORE_CHANGES_TABLE'):
+        return
+    try:
+        now = time.time()
+        boto3.resource('dynamodb').Table(os.environ['STORE_CHANGES_TABLE']).put_item(
+            Item={
+                'particao': 'lojas',
+                'versao': f"{int(now * 1000):013d}#{address_id}",
+                'id_Endereco': address_id,
+                'removida': removed,
+                'expira_em': int(now) + STORE_CHANGES_TTL_SECONDS
+            }
+        )
+    except Exception as ex:
+        print(f"Erro ao registrar alteração da loja {address_id}: {str(ex)}")
+
+def is_store_address(user_table, address: dict) -> bool:
+    response_user = user_table.query(
+        IndexName='fk_id_Endereco-index',
+        KeyConditionExpression=boto3.dynamodb.conditions.Key('fk_id_Endereco').eq(address['id_Endereco'])
+    )
+
+    if 'Items' not in response_user or len(response_user['Items']) == 0:
+        return False
+
+    return response_user['Items'][0].get('Usuario_Tipo') != 'customer'
+
+def backfill_address(address_table, address: dict, is_store: bool) -> bool:
+    if not address.get('cep'):
+        return False
+
+    location = get_address_location(address['cep'], is_store)
+    if not location:
+        return False
+
+    location['atualizado_em'] = int(time.time())
+    update_expression = "SET " + ", ".join(f"{attribute} = :{attribute}" for attribute in location)
+    expression_values = {f':{attribute}': value for attribute, value in location.items()}
+
+    if is_store:
+        update_expression += ", flag_loja = :flag_loja"
+        expression_values[':flag_loja'] = True
+    else:
+        update_expression += " REMOVE flag_loja, geohash, geohash_celula"
+
+    address_table.update_item(
+        Key={'id_Endereco': address['id_Endereco']},
+        UpdateExpression=update_expression,
+        ExpressionAttributeValues=expression_values
+    )
+    if is_store or address.get('flag_loja'):
+        record_store_change(address['id_Endereco'])
+    return True
+
+def is_backfilled(address: dict, is_store: bool) -> bool:
+    if 'latitude' not in address or 'longitude' not in address:
+        return False
+    if is_store:
+        return address.get('flag_loja') is True and 'geohash' in address
+    return 'flag_loja' not in address and 'geohash' not in address
+
+def lambda_handler(event:any, context:any):
+    try:
+        event = event or {}
+        force = bool(event.get('force', False))
+
+        dynamodb = boto3.resource('dynamodb')
+        address_table = dynamodb.Table(os.environ['TABLE_NAME'])
+        user_table = dynamodb.Table(os.environ['USER_TABLE'])
+
+        scan_params = {}
+        total = 0
+        updated = 0
+        skipped = 0
+
+        done = False
+        while not done:
+            response = address_table.scan(**scan_params)
+
+            for address in response.get('Items', []):
+                total += 1
+                is_store = is_store_address(user_table, address)
+                if is_backfilled(address, is_store) and not force:
+                    skipped += 1
+                    continue
+
+                if backfill_address(address_table, address, is_store):
+                    updated += 1
+                else:
+                    skipped += 1
+
+            start_key = response.get('LastEvaluatedKey', None)
+            if start_key:
+                scan_params['ExclusiveStartKey'] = start_key
+            done = start_key is None
+
+        print(f"Backfill concluído: {updated} endereços atualizados de {total} ({skipped} ignorados)")
+        return {
+            'statusCode': 200,
+            'body': json.dumps({'total': total, 'atualizados': updated, 'ignorados': skipped}, default=str)
+        }
+    except Exception as ex:
+        print(f"Erro ao atualizar localização dos endereços: {str(ex)}")
+        return {
+            'statusCode': 500,
+            'body': json.dumps({'message': 'Erro ao atualizar localização dos endereços: ' + str(ex)}, default=str)
+        }
+
+
+if __name__ == "__main__":
+    os.environ['TABLE_NAME'] = 'Loja_Endereco'
+    os.environ['USER_TABLE'] = 'Usuario'
+    os.environ['CEP_CACHE_TABLE'] = 'Cache_CEP'
+    os.environ['STORE_CHANGES_TABLE'] = ''
+    print(lambda_handler({'force': False}, None))
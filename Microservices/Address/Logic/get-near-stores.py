@@ -1,12 +1,100 @@
+import heapq
+import base64
 import json
 import boto3
 import os
+import time
 import requests
+from collections import OrderedDict
+from decimal import Decimal
 import re
-from math import radians, sin, cos, sqrt, atan2
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from math import radians, cos, degrees
+import numpy as np
+
+class TTLCache:
+    def __init__(self, namespace: str, max_size: int, ttl_seconds: float):
+        env_prefix = f'CACHE_{namespace.upper()}'
+        self.namespace = namespace
+        self.max_size = int(os.environ.get(f'{env_prefix}_MAX_SIZE', max_size))
+        self.ttl_seconds = float(os.environ.get(f'{env_prefix}_TTL_SECONDS', ttl_seconds))
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.items.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self.items[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self.items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.items[key] = (value, time.monotonic() + self.ttl_seconds)
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self.lock:
+            self.items.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+    def stats(self) -> dict:
+        return {
+            'namespace': self.namespace,
+            'size': len(self.items),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations
+        }
+
+IMAGE_CACHE = TTLCache('image', max_size=2000, ttl_seconds=3600)
+
+CEP_COORDINATES_URL = os.environ.get('CEP_COORDINATES_URL', 'https://cep.awesomeapi.com.br/json')
+
+EARTH_RADIUS_METERS = 6371000
+DEFAULT_SEARCH_RADIUS_METERS = 500.0
+MAX_SEARCH_RADIUS_METERS = 4000.0
+MAX_NEAREST_STORES = 1000
+FIRST_RING_METERS = 250.0
+METERS_PER_DEGREE = 111320.0
 
-IMAGE_CACHE = {}
-CEP_CACHE = {}
+STORE_INDEX_ENABLED = os.environ.get('STORE_INDEX_ENABLED', 'true').lower() == 'true'
+STORE_INDEX_CELL_DEGREES = float(os.environ.get('STORE_INDEX_CELL_DEGREES', '0.01'))
+STORE_INDEX_REFRESH_SECONDS = int(os.environ.get('STORE_INDEX_REFRESH_SECONDS', '60'))
+STORE_INDEX_MAX_AGE_SECONDS = int(os.environ.get('STORE_INDEX_MAX_AGE_SECONDS', '900'))
+STORE_INDEX_CLOCK_SKEW_SECONDS = 5
+STORE_INDEX = None
+
+STORE_SCAN_SEGMENTS = int(os.environ.get('STORE_SCAN_SEGMENTS', '4'))
+STORE_ATTRIBUTES = ['id_Endereco', 'cep', 'logradouro', 'numero', 'complemento', 'nome_Loja', 'descricao_Loja', 'id_Imagem', 'tipo_Entrega', 'latitude', 'longitude']
+SCAN_EXECUTOR = ThreadPoolExecutor(max_workers=max(1, STORE_SCAN_SEGMENTS))
+
+GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_CELL_PRECISION = 5
+GEOHASH_MAX_SEARCH_PRECISION = 7
 
 dynamodb = boto3.resource('dynamodb')
 s3_client = boto3.client('s3')
@@ -15,48 +103,226 @@ def is_valid_email(email: str) -> bool:
     email_regex = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
     return re.match(email_regex, email) is not None
 
-def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
-    R = 6371000
-
-    lat1_rad = radians(lat1)
-    lon1_rad = radians(lon1)
-    lat2_rad = radians(lat2)
-    lon2_rad = radians(lon2)
+def haversine_distances(origin_latitude: float, origin_longitude: float, latitudes: np.ndarray, longitudes: np.ndarray) -> np.ndarray:
+    origin_lat_rad = np.radians(origin_latitude)
+    lat_rad = np.radians(latitudes)
+
+    dlat = lat_rad - origin_lat_rad
+    dlon = np.radians(longitudes - origin_longitude)
+
+    a = np.sin(dlat / 2)**2 + np.cos(origin_lat_rad) * np.cos(lat_rad) * np.sin(dlon / 2)**2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+    return EARTH_RADIUS_METERS * c
+
+def encode_geohash(latitude: float, longitude: float, precision: int = 9) -> str:
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    geohash = []
+    bits = 0
+    char_index = 0
+    even = True
+
+    while len(geohash) < precision:
+        coord_range, value = (lng_range, longitude) if even else (lat_range, latitude)
+        mid = (coord_range[0] + coord_range[1]) / 2
+        char_index <<= 1
+        if value >= mid:
+            char_index |= 1
+            coord_range[0] = mid
+        else:
+            coord_range[1] = mid
+
+        even = not even
+        bits += 1
+        if bits == 5:
+            geohash.append(GEOHASH_BASE32[char_index])
+            bits = 0
+            char_index = 0
+
+    return ''.join(geohash)
+
+def decode_geohash(geohash: str):
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    even = True
+
+    for char in geohash:
+        char_index = GEOHASH_BASE32.index(char)
+        for shift in range(4, -1, -1):
+            coord_range = lng_range if even else lat_range
+            mid = (coord_range[0] + coord_range[1]) / 2
+            if (char_index >> shift) & 1:
+                coord_range[0] = mid
+            else:
+                coord_range[1] = mid
+            even = not even
+
+    latitude = (lat_range[0] + lat_range[1]) / 2
+    longitude = (lng_range[0] + lng_range[1]) / 2
+    return latitude, longitude, lat_range[1] - lat_range[0], lng_range[1] - lng_range[0]
+
+def get_geohash_neighbourhood(geohash: str):
+    latitude, longitude, lat_size, lng_size = decode_geohash(geohash)
+
+    cells = []
+    for lat_step in (-1, 0, 1):
+        for lng_step in (-1, 0, 1):
+            neighbour_lat = latitude + lat_step * lat_size
+            if neighbour_lat > 90 or neighbour_lat < -90:
+                continue
+            neighbour_lng = (longitude + lng_step * lng_size + 180) % 360 - 180
+            cell = encode_geohash(neighbour_lat, neighbour_lng, len(geohash))
+            if cell not in cells:
+                cells.append(cell)
 
-    dlon = lon2_rad - lon1_rad
-    dlat = lat2_rad - lat1_rad
+    return cells
 
-    a = sin(dlat / 2)**2 + cos(lat1_rad) * cos(lat2_rad) * sin(dlon / 2)**2
-    c = 2 * atan2(sqrt(a), sqrt(1 - a))
+def get_search_precision(latitude: float, radius: float) -> int:
+    for precision in range(GEOHASH_MAX_SEARCH_PRECISION, GEOHASH_CELL_PRECISION, -1):
+        lat_bits = (5 * precision) // 2
+        lng_bits = 5 * precision - lat_bits
+        cell_height = 180.0 / (2 ** lat_bits) * METERS_PER_DEGREE
+        cell_width = 360.0 / (2 ** lng_bits) * METERS_PER_DEGREE * cos(radians(latitude))
+        if min(cell_height, cell_width) >= radius:
+            return precision
 
-    distance = R * c
-    return distance
+    return GEOHASH_CELL_PRECISION
 
 def get_table(table_env_var):
     table_name = os.environ[table_env_var]
     return dynamodb.Table(table_name)
 
-def get_cep_coordinates(cep):
+def get_store_projection(attributes=STORE_ATTRIBUTES):
+    return {
+        'ProjectionExpression': ', '.join(f'#p{index}' for index in range(len(attributes))),
+        'ExpressionAttributeNames': {f'#p{index}': attribute for index, attribute in enumerate(attributes)}
+    }
+
+def parallel_scan(table_env_var, scan_params, total_segments=STORE_SCAN_SEGMENTS):
+    def scan_segment(segment):
+        segment_params = {**scan_params, 'TableName': os.environ[table_env_var], 'Segment': segment, 'TotalSegments': total_segments}
+        items = []
+
+        while True:
+            response = dynamodb.meta.client.scan(**segment_params)
+            items.extend(response.get('Items', []))
+
+            start_key = response.get('LastEvaluatedKey', None)
+            if not start_key:
+                return items
+            segment_params['ExclusiveStartKey'] = start_key
+
+    return [item for items in SCAN_EXECUTOR.map(scan_segment, range(total_segments)) for item in items]
+
+CEP_CACHE_MAX_SIZE = int(os.environ.get('CEP_CACHE_MAX_SIZE', '2048'))
+CEP_CACHE_TTL_SECONDS = int(os.environ.get('CEP_CACHE_TTL_SECONDS', str(30 * 24 * 60 * 60)))
+CEP_CACHE_NEGATIVE_TTL_SECONDS = int(os.environ.get('CEP_CACHE_NEGATIVE_TTL_SECONDS', str(24 * 60 * 60)))
+CEP_CACHE = OrderedDict()
+CEP_CACHE_STATS = {'hit_memoria': 0, 'hit_dynamodb': 0, 'miss': 0, 'negativo': 0}
+CEP_CACHE_TABLE = None
+
+def get_cep_cache_table():
+    global CEP_CACHE_TABLE
+    if CEP_CACHE_TABLE is None and os.environ.get('CEP_CACHE_TABLE'):
+        CEP_CACHE_TABLE = boto3.resource('dynamodb').Table(os.environ['CEP_CACHE_TABLE'])
+    return CEP_CACHE_TABLE
+
+def remember_cep(cep: str, coordinates, expires_at: float):
+    CEP_CACHE[cep] = (coordinates, expires_at)
+    CEP_CACHE.move_to_end(cep)
+    while len(CEP_CACHE) > CEP_CACHE_MAX_SIZE:
+        CEP_CACHE.popitem(last=False)
+
+def get_cached_cep(cep: str):
+    now = time.time()
     if cep in CEP_CACHE:
-        return CEP_CACHE[cep]
-    
+        coordinates, expires_at = CEP_CACHE[cep]
+        if expires_at > now:
+            CEP_CACHE.move_to_end(cep)
+            CEP_CACHE_STATS['hit_memoria'] += 1
+            return True, coordinates
+        del CEP_CACHE[cep]
+
+    cache_table = get_cep_cache_table()
+    if cache_table is not None:
+        try:
+            item = cache_table.get_item(Key={'cep': cep}).get('Item')
+            if item and int(item['expira_em']) > now:
+                coordinates = None
+                if item.get('valido'):
+                    coordinates = {
+                        'latitude': float(item['latitude']),
+                        'longitude': float(item['longitude'])
+                    }
+                remember_cep(cep, coordinates, int(item['expira_em']))
+                CEP_CACHE_STATS['hit_dynamodb'] += 1
+                return True, coordinates
+        except Exception as ex:
+            print(f"Erro ao consultar cache do CEP {cep}: {str(ex)}")
+
+    CEP_CACHE_STATS['miss'] += 1
+    return False, None
+
+def cache_cep(cep: str, coordinates):
+    ttl = CEP_CACHE_TTL_SECONDS if coordinates else CEP_CACHE_NEGATIVE_TTL_SECONDS
+    expires_at = int(time.time()) + ttl
+    remember_cep(cep, coordinates, expires_at)
+
+    cache_table = get_cep_cache_table()
+    if cache_table is None:
+        return
+
+    item = {'cep': cep, 'valido': coordinates is not None, 'expira_em': expires_at}
+    if coordinates:
+        item['latitude'] = Decimal(str(coordinates['latitude']))
+        item['longitude'] = Decimal(str(coordinates['longitude']))
+
     try:
-        response = requests.get(f"https://cep.awesomeapi.com.br/json/{cep}")
+        cache_table.put_item(Item=item)
+    except Exception as ex:
+        print(f"Erro ao salvar cache do CEP {cep}: {str(ex)}")
+
+def get_cep_coordinates(cep: str):
+    found, coordinates = get_cached_cep(cep)
+    if found:
+        return coordinates
+
+    try:
+        response = requests.get(f"{CEP_COORDINATES_URL}/{cep}")
+        if response.status_code in (400, 404):
+            CEP_CACHE_STATS['negativo'] += 1
+            cache_cep(cep, None)
+            return None
         if response.status_code != 200:
             return None
-        
+
         data = response.json()
         coordinates = {
             'latitude': float(data["lat"]),
             'longitude': float(data["lng"])
         }
-        
-        CEP_CACHE[cep] = coordinates
+
+        cache_cep(cep, coordinates)
         return coordinates
     except Exception as ex:
         print(f"Erro ao buscar coordenadas do CEP {cep}: {str(ex)}")
         return None
 
+def get_address_coordinates(address: dict):
+    if address.get('latitude') is not None and address.get('longitude') is not None:
+        return {
+            'latitude': float(address['latitude']),
+            'longitude': float(address['longitude'])
+        }
+
+    cep = address.get('cep')
+    if not cep:
+        return None
+
+    print(f"Endereço {address.get('id_Endereco')} sem coordenadas salvas, consultando CEP {cep}")
+    return get_cep_coordinates(cep)
+
 def get_user_by_email(email):
     user_table = get_table('TABLE_USER')
     response = user_table.query(
@@ -82,89 +348,251 @@ def get_store_image(id_imagem):
     if not id_imagem:
         return None
     
-    if id_imagem in IMAGE_CACHE:
-        return IMAGE_CACHE[id_imagem]
+    cached = IMAGE_CACHE.get(id_imagem)
+    if cached is not None:
+        return cached
     
     try:
         bucket_name = os.environ['BUCKET_NAME']
         image_url = f"https://{bucket_name}.s3.amazonaws.com/{id_imagem}"
         
-        IMAGE_CACHE[id_imagem] = image_url
+        IMAGE_CACHE.set(id_imagem, image_url)
         return image_url
     except Exception as ex:
         print(f"Erro ao buscar imagem com id: {id_imagem}: {str(ex)}")
         return None
 
-def get_all_stores(limit=100):
+def get_candidate_stores(origin_coords, radius=DEFAULT_SEARCH_RADIUS_METERS):
     address_table = get_table('ADRESS_STORE_TABLE')
-    user_table = get_table('TABLE_USER')
-    
-    scan_params = {}
-    
+
+    precision = get_search_precision(origin_coords['latitude'], radius)
+    origin_geohash = encode_geohash(origin_coords['latitude'], origin_coords['longitude'], precision)
+
     stores = []
-    done = False
-    start_key = None
-    while not done:
-        if start_key:
-            scan_params['ExclusiveStartKey'] = start_key
-        
-        addresses = address_table.scan(**scan_params)
-        
-        if 'Items' not in addresses:
-            print("Nenhum endereço encontrado.")
-            break
+    for cell in get_geohash_neighbourhood(origin_geohash):
+        query_params = {
+            'IndexName': 'geohash_celula-index',
+            'KeyConditionExpression': boto3.dynamodb.conditions.Key('geohash_celula').eq(cell[:GEOHASH_CELL_PRECISION]),
+            'FilterExpression': boto3.dynamodb.conditions.Attr('flag_loja').eq(True),
+            **get_store_projection()
+        }
+        if len(cell) > GEOHASH_CELL_PRECISION:
+            query_params['KeyConditionExpression'] &= boto3.dynamodb.conditions.Key('geohash').begins_with(cell)
 
-        for address in addresses['Items']:
-            address_id = address.get("id_Endereco")
-            if not address_id:
-                continue
+        done = False
+        while not done:
+            addresses = address_table.query(**query_params)
 
-            response_user = user_table.query(
-                IndexName='fk_id_Endereco-index',
-                KeyConditionExpression=boto3.dynamodb.conditions.Key('fk_id_Endereco').eq(address_id)
-            )
+            stores.extend(addresses.get('Items', []))
 
-            if 'Items' in response_user and len(response_user['Items']) > 0:
-                user_info = response_user['Items'][0]
-                if user_info.get('Usuario_Tipo') in ['seller', 'customer_seller']:
-                    stores.append(address)
-        
-        start_key = addresses.get('LastEvaluatedKey', None)
-        done = start_key is None
+            start_key = addresses.get('LastEvaluatedKey', None)
+            if start_key:
+                query_params['ExclusiveStartKey'] = start_key
+            done = start_key is None
 
-        if len(stores) >= limit: 
-             print(f"Atingido limite de {limit} lojas encontradas. Interrompendo scan.")
-             break 
-        
     return stores
 
-def get_stores_within_500_meters(origin_cep, stores):
-    origin_coords = get_cep_coordinates(origin_cep)
-    if not origin_coords:
-        raise ValueError("Problema ao validar CEP informado")
-    
+def scan_stores():
+    scan_params = {
+        'IndexName': 'geohash_celula-index',
+        'FilterExpression': boto3.dynamodb.conditions.Attr('flag_loja').eq(True),
+        **get_store_projection()
+    }
+
+    return parallel_scan('ADRESS_STORE_TABLE', scan_params)
+
+def get_store_changes(since: float) -> dict:
+    query_params = {
+        'TableName': os.environ['STORE_CHANGES_TABLE'],
+        'KeyConditionExpression': boto3.dynamodb.conditions.Key('particao').eq('lojas') & boto3.dynamodb.conditions.Key('versao').gt(f"{int(since * 1000):013d}"),
+        'ProjectionExpression': 'id_Endereco, removida'
+    }
+
+    changes = {}
+    while True:
+        response = dynamodb.meta.client.query(**query_params)
+        for change in response.get('Items', []):
+            changes[change['id_Endereco']] = bool(change.get('removida'))
+
+        start_key = response.get('LastEvaluatedKey', None)
+        if not start_key:
+            return changes
+        query_params['ExclusiveStartKey'] = start_key
+
+def get_stores_by_id(store_ids) -> dict:
+    table_name = os.environ['ADRESS_STORE_TABLE']
+    store_ids = list(store_ids)
+    stores = {}
+
+    for start in range(0, len(store_ids), 100):
+        request_items = {
+            table_name: {
+                'Keys': [{'id_Endereco': store_id} for store_id in store_ids[start:start + 100]],
+                **get_store_projection(STORE_ATTRIBUTES + ['flag_loja'])
+            }
+        }
+        while request_items:
+            response = dynamodb.meta.client.batch_get_item(RequestItems=request_items)
+            for store in response.get('Responses', {}).get(table_name, []):
+                stores[store['id_Endereco']] = store
+            request_items = response.get('UnprocessedKeys') or None
+
+    return stores
+
+def apply_store_changes(index, since: float) -> int:
+    changes = get_store_changes(since)
+    stores = get_stores_by_id(store_id for store_id, removed in changes.items() if not removed)
+
+    for store_id, removed in changes.items():
+        store = stores.get(store_id)
+        if removed or store is None or not store.pop('flag_loja', False):
+            index.remove(store_id)
+        else:
+            index.upsert(store)
+
+    return len(changes)
+
+class StoreGridIndex:
+    def __init__(self, cell_degrees: float):
+        self.cell_degrees = cell_degrees
+        self.stores = {}
+        self.store_cells = {}
+        self.cells = {}
+        self.built_at = 0
+        self.synced_at = 0
+
+    def get_cell(self, latitude: float, longitude: float):
+        return int(latitude // self.cell_degrees), int(longitude // self.cell_degrees)
+
+    def remove(self, store_id):
+        cell = self.store_cells.pop(store_id, None)
+        if cell is not None:
+            self.cells[cell].discard(store_id)
+            if not self.cells[cell]:
+                del self.cells[cell]
+        self.stores.pop(store_id, None)
+
+    def upsert(self, store: dict):
+        store_id = store.get('id_Endereco')
+        if store_id is None:
+            return
+
+        self.remove(store_id)
+        if store.get('latitude') is None or store.get('longitude') is None:
+            return
+
+        cell = self.get_cell(float(store['latitude']), float(store['longitude']))
+        self.stores[store_id] = store
+        self.store_cells[store_id] = cell
+        self.cells.setdefault(cell, set()).add(store_id)
+
+    def query(self, latitude: float, longitude: float, radius: float):
+        lat_margin = degrees(radius / EARTH_RADIUS_METERS)
+        lng_margin = lat_margin / max(cos(radians(latitude)), 1e-6)
+
+        min_row, min_col = self.get_cell(latitude - lat_margin, longitude - lng_margin)
+        max_row, max_col = self.get_cell(latitude + lat_margin, longitude + lng_margin)
+
+        candidates = []
+        for row in range(min_row, max_row + 1):
+            for col in range(min_col, max_col + 1):
+                for store_id in self.cells.get((row, col), ()):
+                    candidates.append(self.stores[store_id])
+
+        return candidates
+
+def get_store_index():
+    global STORE_INDEX
+    now = time.time()
+
+    # Sem a tabela de alterações não há como enxergar lojas removidas, então o índice é reconstruído a cada atualização
+    refresh_due = STORE_INDEX is not None and now - STORE_INDEX.synced_at >= STORE_INDEX_REFRESH_SECONDS
+    if STORE_INDEX is None or now - STORE_INDEX.built_at >= STORE_INDEX_MAX_AGE_SECONDS or (refresh_due and not os.environ.get('STORE_CHANGES_TABLE')):
+        index = StoreGridIndex(STORE_INDEX_CELL_DEGREES)
+        for store in scan_stores():
+            index.upsert(store)
+        index.built_at = now
+        index.synced_at = now
+        STORE_INDEX = index
+        print(f"Índice de lojas construído com {len(index.stores)} lojas")
+    elif refresh_due:
+        changed = apply_store_changes(STORE_INDEX, STORE_INDEX.synced_at - STORE_INDEX_CLOCK_SKEW_SECONDS)
+        STORE_INDEX.synced_at = now
+        print(f"Índice de lojas atualizado com {changed} lojas alteradas")
+
+    return STORE_INDEX
+
+def get_nearest_stores(origin_coords, stores, radius=DEFAULT_SEARCH_RADIUS_METERS, k=None, after=None):
     origin_latitude = origin_coords['latitude']
     origin_longitude = origin_coords['longitude']
 
-    stores_within_500_meters = []
+    located_stores = []
+    latitudes = []
+    longitudes = []
     for store in stores:
-        store_cep = store.get("cep")
-        if not store_cep:
-            continue
-
-        store_coords = get_cep_coordinates(store_cep)
+        store_coords = get_address_coordinates(store)
         if not store_coords:
             continue
 
-        store_latitude = store_coords['latitude']
-        store_longitude = store_coords['longitude']
-        
-        distance = haversine_distance(origin_latitude, origin_longitude, store_latitude, store_longitude)
+        located_stores.append(store)
+        latitudes.append(store_coords['latitude'])
+        longitudes.append(store_coords['longitude'])
+
+    if not located_stores:
+        return []
+
+    latitudes = np.ascontiguousarray(latitudes, dtype=np.float64)
+    longitudes = np.ascontiguousarray(longitudes, dtype=np.float64)
+
+    lat_margin = degrees(radius / EARTH_RADIUS_METERS)
+    lng_margin = lat_margin / max(cos(radians(origin_latitude)), 1e-6)
+    lng_offsets = (longitudes - origin_longitude + 180) % 360 - 180
+
+    in_box = np.flatnonzero(
+        (np.abs(latitudes - origin_latitude) <= lat_margin) & (np.abs(lng_offsets) <= lng_margin)
+    )
+    if in_box.size == 0:
+        return []
+
+    distances = haversine_distances(origin_latitude, origin_longitude, latitudes[in_box], longitudes[in_box])
+    within_radius = distances <= radius
+
+    ranked = (
+        (distance, str(located_stores[index]['id_Endereco']), index)
+        for distance, index in zip(distances[within_radius].tolist(), in_box[within_radius].tolist())
+    )
+    if after is not None:
+        ranked = (entry for entry in ranked if entry[:2] > after)
+
+    nearest = heapq.nsmallest(k or int(np.count_nonzero(within_radius)), ranked)
 
-        if distance <= 500.0: 
-            stores_within_500_meters.append(store)
+    return [(distance, located_stores[index]) for distance, _, index in nearest]
 
-    return stores_within_500_meters
+def get_store_page(origin_coords, radius, page_size, after=None):
+    search_radius = min(radius, max(2 * after[0] if after else 0, FIRST_RING_METERS))
+
+    while True:
+        if STORE_INDEX_ENABLED:
+            candidate_stores = get_store_index().query(origin_coords['latitude'], origin_coords['longitude'], search_radius)
+        else:
+            candidate_stores = get_candidate_stores(origin_coords, search_radius)
+
+        page = get_nearest_stores(origin_coords, candidate_stores, search_radius, page_size, after)
+        if len(page) >= page_size or search_radius >= radius:
+            return page
+
+        search_radius = min(radius, search_radius * 2)
+
+def encode_cursor(distance: float, store_id, returned: int) -> str:
+    cursor = json.dumps({'d': distance, 'id': str(store_id), 'n': returned})
+    return base64.urlsafe_b64encode(cursor.encode()).decode()
+
+def decode_cursor(token: str):
+    try:
+        cursor = json.loads(base64.urlsafe_b64decode(token.encode()).decode())
+        return (float(cursor['d']), str(cursor['id'])), int(cursor['n'])
+    except Exception:
+        raise ValueError("nextToken inválido")
 
 def lambda_handler(event: any, context: any):
     try:
@@ -175,6 +603,22 @@ def lambda_handler(event: any, context: any):
             limit = min(int(query_params.get('limit', '100')), 1000)
         except ValueError:
             limit = 100
+
+        try:
+            radius = float(query_params.get('radius', DEFAULT_SEARCH_RADIUS_METERS))
+        except ValueError:
+            raise ValueError("radius deve ser um número")
+        if radius <= 0:
+            raise ValueError("radius deve ser maior que zero")
+        radius = min(radius, MAX_SEARCH_RADIUS_METERS)
+
+        k = query_params.get('k')
+        try:
+            k = min(int(k), MAX_NEAREST_STORES) if k else None
+        except ValueError:
+            raise ValueError("k deve ser um inteiro")
+        if k is not None and k <= 0:
+            raise ValueError("k deve ser maior que zero")
         
         if not email:
             raise ValueError("email não fornecido")
@@ -225,20 +669,40 @@ def lambda_handler(event: any, context: any):
                 'body': json.dumps({'message': "CEP não encontrado para o endereço do usuário"}, default=str)
             }
 
-        all_stores = get_all_stores(limit)
-        
-        stores_within_500_range = get_stores_within_500_meters(cep, all_stores)
+        origin_coords = get_address_coordinates(address)
+        if not origin_coords:
+            raise ValueError("Problema ao validar CEP informado")
+
+        after, returned = None, 0
+        if query_params.get('nextToken'):
+            after, returned = decode_cursor(query_params['nextToken'])
+
+        page_size = limit if k is None else min(limit, k - returned)
+        nearest_stores = get_store_page(origin_coords, radius, page_size, after) if page_size > 0 else []
+
+        next_token = None
+        if nearest_stores and len(nearest_stores) == page_size and (k is None or returned + page_size < k):
+            last_distance, last_store = nearest_stores[-1]
+            next_token = encode_cursor(last_distance, last_store['id_Endereco'], returned + page_size)
 
         result_stores = []
-        for store in stores_within_500_range:
+        for distance, store in nearest_stores:
             store_data = store.copy()
+            store_data['distancia'] = round(distance, 1)
             store_image_id = store_data.get('id_Imagem')
             store_data['imagem'] = get_store_image(store_image_id) if store_image_id else None
             result_stores.append(store_data)
 
+        print(f"Cache de CEP: {CEP_CACHE_STATS}")
+        print(f"Cache de imagens: {IMAGE_CACHE.stats()}")
+
+        response_body = {"lojas": result_stores}
+        if next_token:
+            response_body["nextToken"] = next_token
+
         return {
             "statusCode": 200,
-            "body": json.dumps({"lojas": result_stores}, default=str),
+            "body": json.dumps(response_body, default=str),
         }
 
     except KeyError as err:
@@ -271,6 +735,8 @@ if __name__ == "__main__":
    os.environ['TABLE_USER'] = ''
    os.environ['ADRESS_STORE_TABLE'] = ''
    os.environ['BUCKET_NAME'] = ''
+   os.environ['CEP_CACHE_TABLE'] = ''
+   os.environ['STORE_CHANGES_TABLE'] = ''
 
    event = {
         'queryStringParameters': {
@@ -2,6 +2,60 @@ import json
 import boto3
 import os
 import datetime
+from zoneinfo import ZoneInfo
+
+DASHBOARD_PAID_STATUS = 'Pago'
+DASHBOARD_REVERSED_STATUSES = ('Reembolsado', 'Chargeback')
+
+def get_faturamento_em(old_order: dict, new_status: str, hora_atual: str):
+    if old_order.get('status_pedido') in DASHBOARD_REVERSED_STATUSES:
+        return None
+    if new_status == DASHBOARD_PAID_STATUS and not old_order.get('data_pagamento'):
+        return hora_atual[:10]
+    if new_status in DASHBOARD_REVERSED_STATUSES and old_order.get('data_pagamento') and not old_order.get('data_estorno'):
+        return old_order['data_pagamento'][:10]
+    return None
+
+def update_store_dashboard(store_id, old_status: str, new_status: str, valor, faturamento_em: str = None):
+    table_name = os.environ.get('TABLE_STORE_DASHBOARD')
+    if not table_name or store_id is None or old_status == new_status:
+        return
+
+    now = datetime.datetime.now(ZoneInfo("America/Sao_Paulo"))
+    add_expressions = []
+    attribute_names = {}
+    attribute_values = {':atualizado_em': now.strftime("%Y-%m-%d %H:%M:%S")}
+
+    if new_status:
+        add_expressions.append("#status_novo :um")
+        attribute_names['#status_novo'] = f"qtd_{new_status}"
+        attribute_values[':um'] = 1
+    if old_status:
+        add_expressions.append("#status_antigo :menos_um")
+        attribute_names['#status_antigo'] = f"qtd_{old_status}"
+        attribute_values[':menos_um'] = -1
+
+    revenue = None
+    if faturamento_em and valor is not None:
+        if new_status == DASHBOARD_PAID_STATUS:
+            revenue = valor
+        elif new_status in DASHBOARD_REVERSED_STATUSES:
+            revenue = -valor
+
+    if revenue is not None:
+        add_expressions.append("#faturamento :faturamento")
+        attribute_names['#faturamento'] = f"faturamento_{faturamento_em}"
+        attribute_values[':faturamento'] = revenue
+
+    try:
+        boto3.resource('dynamodb').Table(table_name).update_item(
+            Key={'id_Loja': store_id},
+            UpdateExpression="SET atualizado_em = :atualizado_em ADD " + ", ".join(add_expressions),
+            ExpressionAttributeNames=attribute_names,
+            ExpressionAttributeValues=attribute_values
+        )
+    except Exception as ex:
+        print(f"Erro ao atualizar painel da loja {store_id}: {str(ex)}")
 
 def lambda_handler(event:any, context:any): 
     try:
@@ -22,20 +76,32 @@ def lambda_handler(event:any, context:any):
         dynamoDB = boto3.resource('dynamodb')
         table_order = dynamoDB.Table(os.environ['TABLE_ORDER'])
 
-        if table_order.get_item(Key={'id_Pedido': id_Pedido}) is None:
+        order = table_order.get_item(Key={'id_Pedido': id_Pedido}).get('Item')
+        if order is None:
             return {
                 "statusCode": 404,
                 "body": json.dumps({f"Pedido {id_Pedido} não encontrado"}, default=str)
             }
         
-        table_order.update_item(
+        hora_atual = datetime.datetime.now(ZoneInfo("America/Sao_Paulo")).strftime("%Y-%m-%d %H:%M:%S")
+        update_expression = "set status_pedido = :status_pedido, status_data_pedido = :status_data_pedido, hora_atualizacao = :hora_atualizacao"
+        if status == DASHBOARD_PAID_STATUS:
+            update_expression += ", data_pagamento = if_not_exists(data_pagamento, :hora_atualizacao)"
+        elif status in DASHBOARD_REVERSED_STATUSES:
+            update_expression += ", data_estorno = if_not_exists(data_estorno, :hora_atualizacao)"
+
+        response_update = table_order.update_item(
             Key={'id_Pedido': id_Pedido},
-            UpdateExpression="set status_pedido = :status_pedido, hora_atualizacao = :hora_atualizacao",
+            UpdateExpression=update_expression,
             ExpressionAttributeValues={
                 ':status_pedido': status,
-                ':hora_atualizacao': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                ':status_data_pedido': f"{status}#{order['data_pedido']}",
+                ':hora_atualizacao': hora_atual
             },
+            ReturnValues='ALL_OLD'
         )
+        old_order = response_update.get('Attributes', order)
+        update_store_dashboard(order.get('fk_id_Endereco'), old_order.get('status_pedido'), status, order.get('valor'), get_faturamento_em(old_order, status, hora_atual))
 
         return {
             "statusCode": 200,
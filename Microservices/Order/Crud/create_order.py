@@ -3,19 +3,164 @@ import datetime
 from decimal import Decimal
 import json
 import boto3
+import base64
 import os
 import uuid
 import re
+import time
+import queue
+import random
+import hashlib
+import math
+import importlib.util
+import threading
+import requests
+from collections import OrderedDict
 from typing import List
 import mercadopago
+from mercadopago.http import HttpClient
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+from botocore.exceptions import ClientError
 from zoneinfo import ZoneInfo
 
+class TTLCache:
+    def __init__(self, namespace: str, max_size: int, ttl_seconds: float):
+        env_prefix = f"CACHE_{namespace.upper()}"
+        self.namespace = namespace
+        self.max_size = int(os.environ.get(f"{env_prefix}_MAX_SIZE", max_size))
+        self.ttl_seconds = float(os.environ.get(f"{env_prefix}_TTL_SECONDS", ttl_seconds))
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.items.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self.items[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self.items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.items[key] = (value, time.monotonic() + self.ttl_seconds)
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self.lock:
+            self.items.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+    def stats(self) -> dict:
+        return {
+            "namespace": self.namespace,
+            "size": len(self.items),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+
+STORE_CACHE = TTLCache('store', max_size=500, ttl_seconds=300)
+MP_SDK_CLIENTS = TTLCache('mp_sdk', max_size=100, ttl_seconds=900)
+
+MP_HTTP_POOL_SIZE = int(os.environ.get('MP_HTTP_POOL_SIZE', '10'))
+MP_HTTP_MAX_RETRIES = int(os.environ.get('MP_HTTP_MAX_RETRIES', '2'))
+MP_HTTP_SESSION = None
+MP_HTTP_SESSION_LOCK = threading.Lock()
+
+def get_mp_session():
+    global MP_HTTP_SESSION
+    with MP_HTTP_SESSION_LOCK:
+        if MP_HTTP_SESSION is None:
+            retry = Retry(total=MP_HTTP_MAX_RETRIES, status_forcelist=(429, 500, 502, 503, 504), backoff_factor=0.2)
+            adapter = HTTPAdapter(pool_connections=MP_HTTP_POOL_SIZE, pool_maxsize=MP_HTTP_POOL_SIZE, max_retries=retry)
+            session = requests.Session()
+            session.mount('https://', adapter)
+            MP_HTTP_SESSION = session
+    return MP_HTTP_SESSION
+
+class PooledHttpClient(HttpClient):
+    def request(self, method, url, maxretries=None, **kwargs):
+        kwargs.pop('retry_on', None)
+        kwargs.pop('backoff_factor', None)
+        api_result = get_mp_session().request(method, url, **kwargs)
+        response = {'status': api_result.status_code, 'response': None}
+
+        if api_result.status_code != 204 and api_result.content:
+            try:
+                response['response'] = api_result.json()
+            except ValueError:
+                print(f"Resposta inválida do Mercado Pago: {api_result.status_code}")
+        return response
+
+def get_mp_sdk(access_token: str):
+    sdk = MP_SDK_CLIENTS.get(access_token)
+    if sdk is None:
+        sdk = mercadopago.SDK(access_token, http_client=PooledHttpClient())
+        MP_SDK_CLIENTS.set(access_token, sdk)
+    return sdk
+
+def get_store(store_id):
+    cached = STORE_CACHE.get(str(store_id))
+    if cached is not None:
+        return cached
+
+    store = boto3.resource('dynamodb').Table(os.environ['STORE_ADDRESS_TABLE']).get_item(Key={'id_Endereco': store_id}).get('Item')
+    if store is not None:
+        STORE_CACHE.set(str(store_id), store)
+    return store
+
+def invalidate_store(store_id, access_token: str = None):
+    STORE_CACHE.invalidate(str(store_id))
+    if access_token:
+        MP_SDK_CLIENTS.invalidate(access_token)
+
 @dataclass
 class Order_Item:
     fk_id_Lote: str
     fk_id_Pedido: str
     quantidade_item: int
     preco_unitario: Decimal
+    nome_produto: str = None
+    id_imagem_produto: str = None
+    id_loja: int = None
+    nome_loja: str = None
+    id_imagem_loja: str = None
+    endereco_loja: str = None
+    cep_loja: str = None
+    tipo_entrega_loja: str = None
+
+    def apply_snapshot(self, product: dict, store: dict):
+        self.preco_unitario = product['valor_venda']
+        self.nome_produto = product.get('nome')
+        self.id_imagem_produto = product.get('id_imagem')
+        self.id_loja = store.get('id_Endereco')
+        self.nome_loja = store.get('nome_Loja')
+        self.id_imagem_loja = store.get('id_Imagem')
+        self.endereco_loja = store.get('logradouro')
+        self.cep_loja = store.get('cep')
+        self.tipo_entrega_loja = store.get('tipo_Entrega')
 
     @staticmethod
     def from_json(json_data: dict):
@@ -39,8 +184,8 @@ class Order:
     valor: Decimal
     tipo_entrega: str
     status_pedido: str = "Aguardando Pagamento"
-    data_pedido: str = datetime.datetime.now(ZoneInfo("America/Sao_Paulo")) .strftime("%Y-%m-%d %H:%M:%S")
-    hora_atualizacao: str = data_pedido
+    data_pedido: str = None
+    hora_atualizacao: str = None
     item_pedido: List[Order_Item] = None
     id_Pedido: str = None
     id_Pagamento: str = None
@@ -48,7 +193,7 @@ class Order:
 
 
     @staticmethod
-    def from_json(json_data: dict):
+    def from_json(json_data: dict, id_pedido: str = None):
         if not isinstance(json_data['fk_Usuario_cpf'], str):
             raise TypeError('fk_Usuario_cpf deve ser uma string')
         if not isinstance(json_data['valor'], (float, int)):
@@ -61,7 +206,9 @@ class Order:
             raise ValueError('Formatação de CPF inválida')
         
         json_data['valor'] = Decimal(str(json_data['valor']))
-        json_data['id_Pedido'] = str(uuid.uuid4())
+        json_data['id_Pedido'] = id_pedido or str(uuid.uuid4())
+        json_data['data_pedido'] = datetime.datetime.now(ZoneInfo("America/Sao_Paulo")).strftime("%Y-%m-%d %H:%M:%S")
+        json_data['hora_atualizacao'] = json_data['data_pedido']
 
         items = []
         for item in json_data['item_pedido']:
@@ -71,16 +218,13 @@ class Order:
 
         return Order(**json_data)
 
-def generate_pix_payment(order: Order, email: str):
+def generate_pix_payment(order: Order, email: str, access_token: str):
     payer = email
-    table_store = boto3.resource('dynamodb').Table(os.environ['STORE_ADDRESS_TABLE'])
-    store = table_store.get_item(Key={'id_Endereco': order.id_Loja})['Item']
-    access_token = store['access_token']
 
-    sdk = mercadopago.SDK(access_token)
+    sdk = get_mp_sdk(access_token)
     request_options = mercadopago.config.RequestOptions()
     request_options.custom_headers = {
-        'x-idempotency-key': str(uuid.uuid4())
+        'x-idempotency-key': order.id_Pedido
     }
 
     payment_data = {
@@ -104,6 +248,8 @@ def generate_pix_payment(order: Order, email: str):
     payment = sdk.payment().create(payment_data, request_options)
     payment_response = payment["response"]
 
+    if payment["status"] == 401:
+        invalidate_store(order.id_Loja, access_token)
     if payment["status"] != 201:
             return {
                 "statusCode": payment_response["status"],
@@ -119,17 +265,229 @@ def generate_pix_payment(order: Order, email: str):
             }, 
             default=str)
 
-def lambda_handler(event:any, context:any):
+def cancel_pix_payment(payment_id, access_token: str):
+    try:
+        payment = get_mp_sdk(access_token).payment().update(str(payment_id), {"status": "cancelled"})
+        if payment["status"] == 200:
+            return True
+        print(f"Erro ao cancelar pagamento {payment_id}: {payment['response']}")
+    except Exception as ex:
+        print(f"Erro ao cancelar pagamento {payment_id}: {str(ex)}")
+    return False
+
+def save_qr_code_image(order_id: str, qr_code_base64: str):
+    bucket_name = os.environ.get('BUCKET_NAME_QR_CODE')
+    if not bucket_name or not qr_code_base64:
+        return None
+
+    try:
+        file_name = f"{order_id}.png"
+        boto3.client('s3').put_object(
+            Bucket=bucket_name,
+            Key=file_name,
+            Body=base64.b64decode(qr_code_base64),
+            ContentType='image/png',
+            ACL='public-read'
+        )
+        return file_name
+    except Exception as ex:
+        print(f"Erro ao salvar imagem do QR code do pedido {order_id}: {str(ex)}")
+        return None
+
+BATCH_GET_MAX_KEYS = 100
+BATCH_GET_MAX_RETRIES = 5
+
+def batch_get_items(table_env_var: str, key_name: str, keys, consistent_read: bool = False):
+    table_name = os.environ[table_env_var]
+    dynamodb = boto3.resource('dynamodb')
+    results = {}
+
+    pending = list(dict.fromkeys(keys))
+    for start in range(0, len(pending), BATCH_GET_MAX_KEYS):
+        request_items = {
+            table_name: {
+                'Keys': [{key_name: key} for key in pending[start:start + BATCH_GET_MAX_KEYS]],
+                'ConsistentRead': consistent_read
+            }
+        }
+        attempt = 0
+        while request_items:
+            response = dynamodb.batch_get_item(RequestItems=request_items)
+            for item in response.get('Responses', {}).get(table_name, []):
+                results[item[key_name]] = item
+
+            request_items = response.get('UnprocessedKeys') or {}
+            if request_items:
+                attempt += 1
+                if attempt > BATCH_GET_MAX_RETRIES:
+                    raise Exception(f"Chaves não processadas em {table_name} após {BATCH_GET_MAX_RETRIES} tentativas")
+                time.sleep(0.05 * (2 ** attempt))
+
+    return results
+
+ORDER_MAX_ITEMS = 49
+RESERVE_MAX_ATTEMPTS = int(os.environ.get('RESERVE_MAX_ATTEMPTS', '4'))
+RESERVE_BACKOFF_SECONDS = 0.05
+
+PIX_PAYMENT_ASYNC = os.environ.get('PIX_PAYMENT_ASYNC', 'false').lower() == 'true'
+PIX_PAYMENT_CREATING_STATUS = 'Criando Pagamento'
+PIX_PAYMENT_LOCAL_QUEUE = os.environ.get('PIX_PAYMENT_LOCAL_QUEUE', 'false').lower() == 'true'
+PIX_PAYMENT_WORKER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Logic', 'create_pix_payment_worker.py')
+LOCAL_PIX_PAYMENT_QUEUE = queue.Queue()
+
+def enqueue_pix_payment(order_id: str):
+    message = json.dumps({'id_Pedido': order_id})
+    queue_url = os.environ.get('PIX_PAYMENT_QUEUE_URL')
+    if not queue_url:
+        if not PIX_PAYMENT_LOCAL_QUEUE:
+            raise Exception('PIX_PAYMENT_QUEUE_URL não configurada')
+        print(f"PIX_PAYMENT_QUEUE_URL não configurada, pagamento do pedido {order_id} enfileirado localmente")
+        LOCAL_PIX_PAYMENT_QUEUE.put(message)
+        return
+
+    sqs = boto3.client('sqs', endpoint_url=os.environ.get('SQS_ENDPOINT_URL') or None)
+    sqs.send_message(QueueUrl=queue_url, MessageBody=message)
+
+def drain_local_pix_payment_queue() -> dict:
+    records = []
+    while not LOCAL_PIX_PAYMENT_QUEUE.empty():
+        records.append({'messageId': str(uuid.uuid4()), 'body': LOCAL_PIX_PAYMENT_QUEUE.get()})
+    return {'Records': records}
+
+def run_local_pix_payment_worker():
+    spec = importlib.util.spec_from_file_location('create_pix_payment_worker', PIX_PAYMENT_WORKER_PATH)
+    worker = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(worker)
+
+    response = worker.lambda_handler(drain_local_pix_payment_queue(), None)
+    if response['batchItemFailures']:
+        print(f"Falha ao processar pagamentos da fila local: {response['batchItemFailures']}")
+    return response
+
+def reserve_order(order: Order, order_row: dict):
+    dynamodb = boto3.resource('dynamodb')
+    actions = []
+    for item in order.item_pedido:
+        actions.append({
+            'Update': {
+                'TableName': os.environ['TABLE_LOTE'],
+                'Key': {'id_Lote': item.fk_id_Lote},
+                'UpdateExpression': 'SET quantidade = quantidade - :quantidade',
+                'ConditionExpression': 'attribute_exists(id_Lote) AND quantidade >= :quantidade',
+                'ExpressionAttributeValues': {':quantidade': item.quantidade_item}
+            }
+        })
+    for item in order.item_pedido:
+        actions.append({'Put': {'TableName': os.environ['TABLE_ITEM_ORDER'], 'Item': item.__dict__}})
+    actions.append({
+        'Put': {
+            'TableName': os.environ['TABLE_ORDER'],
+            'Item': order_row,
+            'ConditionExpression': 'attribute_not_exists(id_Pedido)'
+        }
+    })
+
+    for attempt in range(RESERVE_MAX_ATTEMPTS):
+        try:
+            dynamodb.meta.client.transact_write_items(TransactItems=actions)
+            return
+        except ClientError as err:
+            if attempt == RESERVE_MAX_ATTEMPTS - 1 or not is_transaction_conflict(err):
+                raise
+            print(f"Conflito ao reservar estoque do pedido {order.id_Pedido}, tentativa {attempt + 1}")
+            time.sleep(random.uniform(0, RESERVE_BACKOFF_SECONDS * 2 ** attempt))
+
+def is_transaction_conflict(err):
+    if err.response['Error']['Code'] != 'TransactionCanceledException':
+        return False
+    codes = [reason.get('Code') for reason in err.response.get('CancellationReasons', [])]
+    return 'TransactionConflict' in codes and 'ConditionalCheckFailed' not in codes
+
+def get_unavailable_lote(order: Order, err):
+    reasons = err.response.get('CancellationReasons', [])
+    for item, reason in zip(order.item_pedido, reasons):
+        if reason.get('Code') == 'ConditionalCheckFailed':
+            return item.fk_id_Lote
+    return None
+
+def release_order(order: Order):
+    dynamodb = boto3.resource('dynamodb')
+    actions = []
+    for item in order.item_pedido:
+        actions.append({
+            'Update': {
+                'TableName': os.environ['TABLE_LOTE'],
+                'Key': {'id_Lote': item.fk_id_Lote},
+                'UpdateExpression': 'SET quantidade = quantidade + :quantidade',
+                'ExpressionAttributeValues': {':quantidade': item.quantidade_item}
+            }
+        })
+    for item in order.item_pedido:
+        actions.append({
+            'Delete': {
+                'TableName': os.environ['TABLE_ITEM_ORDER'],
+                'Key': {'fk_id_Pedido': item.fk_id_Pedido, 'fk_id_Lote': item.fk_id_Lote}
+            }
+        })
+    actions.append({'Delete': {'TableName': os.environ['TABLE_ORDER'], 'Key': {'id_Pedido': order.id_Pedido}}})
+
+    try:
+        dynamodb.meta.client.transact_write_items(TransactItems=actions)
+    except Exception as ex:
+        print(f"Erro ao liberar estoque do pedido {order.id_Pedido}: {str(ex)}")
+
+DASHBOARD_PAID_STATUS = 'Pago'
+DASHBOARD_REVERSED_STATUSES = ('Reembolsado', 'Chargeback')
+
+def update_store_dashboard(store_id, old_status: str, new_status: str, valor, faturamento_em: str = None):
+    table_name = os.environ.get('TABLE_STORE_DASHBOARD')
+    if not table_name or store_id is None or old_status == new_status:
+        return
+
+    now = datetime.datetime.now(ZoneInfo("America/Sao_Paulo"))
+    add_expressions = []
+    attribute_names = {}
+    attribute_values = {':atualizado_em': now.strftime("%Y-%m-%d %H:%M:%S")}
+
+    if new_status:
+        add_expressions.append("#status_novo :um")
+        attribute_names['#status_novo'] = f"qtd_{new_status}"
+        attribute_values[':um'] = 1
+    if old_status:
+        add_expressions.append("#status_antigo :menos_um")
+        attribute_names['#status_antigo'] = f"qtd_{old_status}"
+        attribute_values[':menos_um'] = -1
+
+    revenue = None
+    if faturamento_em and valor is not None:
+        if new_status == DASHBOARD_PAID_STATUS:
+            revenue = valor
+        elif new_status in DASHBOARD_REVERSED_STATUSES:
+            revenue = -valor
+
+    if revenue is not None:
+        add_expressions.append("#faturamento :faturamento")
+        attribute_names['#faturamento'] = f"faturamento_{faturamento_em}"
+        attribute_values[':faturamento'] = revenue
+
+    try:
+        boto3.resource('dynamodb').Table(table_name).update_item(
+            Key={'id_Loja': store_id},
+            UpdateExpression="SET atualizado_em = :atualizado_em ADD " + ", ".join(add_expressions),
+            ExpressionAttributeNames=attribute_names,
+            ExpressionAttributeValues=attribute_values
+        )
+    except Exception as ex:
+        print(f"Erro ao atualizar painel da loja {store_id}: {str(ex)}")
+
+def process_order(event:any, id_pedido: str = None, resume: bool = False):
     try:
 
         body = json.loads(event['body'])
-        order = Order.from_json(body)
+        order = Order.from_json(body, id_pedido)
 
         table_user = boto3.resource('dynamodb').Table(os.environ['TABLE_USER'])
-        table_lote = boto3.resource('dynamodb').Table(os.environ['TABLE_LOTE'])
         table_order = boto3.resource('dynamodb').Table(os.environ['TABLE_ORDER'])
-        table_item_order = boto3.resource('dynamodb').Table(os.environ['TABLE_ITEM_ORDER'])
-        table_product = boto3.resource('dynamodb').Table(os.environ['TABLE_PRODUCT'])
 
         response_user = table_user.get_item(
             Key={'cpf': order.fk_Usuario_cpf}
@@ -143,32 +501,53 @@ def lambda_handler(event:any, context:any):
         
         email = response_user['Item']['email']
 
-        valor_total = 0
+        store = get_store(order.id_Loja)
+        if store is None:
+            print(f"Loja não encontrada: {order.id_Loja}")
+            return {
+                'statusCode': 404,
+                'body': json.dumps({'message': f'Loja {order.id_Loja} não encontrada'})
+            }
+
+        items_by_lote = {}
         for item in order.item_pedido:
-            response_lote = table_lote.get_item(
-                Key={'id_Lote': item.fk_id_Lote}
-            )
-            if 'Item' not in response_lote:
+            if item.fk_id_Lote in items_by_lote:
+                items_by_lote[item.fk_id_Lote].quantidade_item += item.quantidade_item
+            else:
+                items_by_lote[item.fk_id_Lote] = item
+        order.item_pedido = list(items_by_lote.values())
+
+        if len(order.item_pedido) > ORDER_MAX_ITEMS:
+            print(f"Pedido com {len(order.item_pedido)} lotes excede o limite de {ORDER_MAX_ITEMS}")
+            return {
+                'statusCode': 400,
+                'body': json.dumps({'message': f'Pedido excede o limite de {ORDER_MAX_ITEMS} lotes diferentes'})
+            }
+
+        lotes = batch_get_items('TABLE_LOTE', 'id_Lote', [item.fk_id_Lote for item in order.item_pedido], consistent_read=True)
+        for item in order.item_pedido:
+            if item.fk_id_Lote not in lotes:
                 print(f"Lote não encontrado: {item.fk_id_Lote}")
                 return {
                     'statusCode': 400,
                     'body': json.dumps({'message': f'Lote {item.fk_id_Lote} não encontrado'})
                 }
-            response_lote_item = response_lote['Item']
 
-            product = table_product.get_item(
-                Key={'id_Produto': response_lote_item['fk_id_Produto']}
-            )
+        products = batch_get_items('TABLE_PRODUCT', 'id_Produto', [lote['fk_id_Produto'] for lote in lotes.values()])
 
-            if 'Item' not in product:
-                print(f"Produto não encontrado: {response_lote_item['fk_id_Produto']}")
+        valor_total = 0
+        for item in order.item_pedido:
+            product_id = lotes[item.fk_id_Lote]['fk_id_Produto']
+            if product_id not in products:
+                print(f"Produto não encontrado: {product_id}")
                 return {
                     'statusCode': 404,
-                    'body': json.dumps({'message': f'Produto {response_lote_item["fk_id_Produto"]} não encontrado'})
+                    'body': json.dumps({'message': f'Produto {product_id} não encontrado'})
                 }
-            
-            product_item = product['Item']
+
+            product_item = products[product_id]
             valor_total += product_item['valor_venda'] * item.quantidade_item
+            item.apply_snapshot(product_item, store)
 
         if valor_total != order.valor:
             print(f"Valor total do pedido ({valor_total}) não corresponde ao valor informado ({order.valor})")
@@ -177,39 +556,130 @@ def lambda_handler(event:any, context:any):
                 'body': json.dumps({'message': 'Valor total do pedido não corresponde ao valor informado'})
             }
 
-        for item in order.item_pedido:
-            response_lote_item = table_lote.get_item(
-                Key={'id_Lote': item.fk_id_Lote}
-            )['Item']
+        existing_order = None
+        if resume:
+            existing_order = table_order.get_item(Key={'id_Pedido': order.id_Pedido}, ConsistentRead=True).get('Item')
 
-            if response_lote_item['quantidade'] < item.quantidade_item:
-                print(f"Quantidade disponível do lote {item.fk_id_Lote} insuficiente")
-                return {
-                    'statusCode': 400,
-                    'body': json.dumps({'message': f'Quantidade disponível do lote {item.fk_id_Lote} insuficiente'})
-                }
-            response_lote_item['quantidade'] -= item.quantidade_item
-            table_lote.put_item(Item=response_lote_item)
-            
-        
-        response_payment = json.loads(generate_pix_payment(order, email))
+        if existing_order is not None:
+            print(f"Retomando pedido {order.id_Pedido} já reservado pela mesma Idempotency-Key")
+            order.status_pedido = existing_order['status_pedido']
+            order.data_pedido = existing_order['data_pedido']
+            order.hora_atualizacao = existing_order['hora_atualizacao']
+        else:
+            for item in order.item_pedido:
+                if lotes[item.fk_id_Lote]['quantidade'] < item.quantidade_item:
+                    print(f"Quantidade disponível do lote {item.fk_id_Lote} insuficiente")
+                    return {
+                        'statusCode': 400,
+                        'body': json.dumps({'message': f'Quantidade disponível do lote {item.fk_id_Lote} insuficiente'})
+                    }
 
-        for item in order.item_pedido:
-            table_item_order.put_item(Item=item.__dict__)
+            if PIX_PAYMENT_ASYNC:
+                order.status_pedido = PIX_PAYMENT_CREATING_STATUS
 
-        table_order.put_item(Item={
+            order_row = {
                 'id_Pedido': order.id_Pedido,
                 'fk_Usuario_cpf': order.fk_Usuario_cpf,
                 'valor': order.valor,
                 'tipo_entrega': order.tipo_entrega,
                 'status_pedido': order.status_pedido,
                 'data_pedido': order.data_pedido,
+                'status_data_pedido': f"{order.status_pedido}#{order.data_pedido}",
                 'hora_atualizacao': order.hora_atualizacao,
-                'fk_id_Endereco': order.id_Loja,
-                'id_Pagamento': response_payment['payment_id'],
-                'id_Transacao': order.id_Transacao
+                'fk_id_Endereco': order.id_Loja
             }
-        )
+
+            try:
+                reserve_order(order, order_row)
+            except ClientError as err:
+                if err.response['Error']['Code'] != 'TransactionCanceledException':
+                    raise
+                if is_transaction_conflict(err):
+                    print(f"Estoque do pedido {order.id_Pedido} em disputa com outros pedidos")
+                    return {
+                        'statusCode': 503,
+                        'body': json.dumps({'message': 'Estoque em disputa com outros pedidos, tente novamente'})
+                    }
+                lote_id = get_unavailable_lote(order, err)
+                if lote_id is None:
+                    raise
+                print(f"Quantidade disponível do lote {lote_id} insuficiente")
+                return {
+                    'statusCode': 400,
+                    'body': json.dumps({'message': f'Quantidade disponível do lote {lote_id} insuficiente'})
+                }
+
+        if PIX_PAYMENT_ASYNC:
+            try:
+                enqueue_pix_payment(order.id_Pedido)
+            except Exception:
+                release_order(order)
+                raise
+
+            if existing_order is None:
+                update_store_dashboard(order.id_Loja, None, order.status_pedido, order.valor)
+            if PIX_PAYMENT_LOCAL_QUEUE and not os.environ.get('PIX_PAYMENT_QUEUE_URL'):
+                run_local_pix_payment_worker()
+            return {
+                'statusCode': 202,
+                'body': json.dumps(
+                    {
+                    'message': 'Pedido criado, pagamento em processamento',
+                    'id_Pedido': order.id_Pedido,
+                    'fk_Usuario_cpf': order.fk_Usuario_cpf,
+                    'valor': float(order.valor),
+                    'tipo_entrega': order.tipo_entrega,
+                    'status_pedido': order.status_pedido,
+                    'data_pedido': order.data_pedido,
+                    'hora_atualizacao': order.hora_atualizacao,
+                    'pagamento': None
+                    }
+                )
+            }
+
+        try:
+            response_payment = generate_pix_payment(order, email, store['access_token'])
+        except Exception:
+            release_order(order)
+            raise
+
+        if isinstance(response_payment, dict):
+            print(f"Erro ao criar pagamento do pedido {order.id_Pedido}, estoque liberado")
+            release_order(order)
+            return response_payment
+
+        response_payment = json.loads(response_payment)
+        qr_code_image_id = save_qr_code_image(order.id_Pedido, response_payment.get('qr_code_base64'))
+
+        payment_values = {
+            ':id_Pagamento': response_payment['payment_id'],
+            ':qr_code': response_payment.get('qr_code'),
+            ':id_Imagem_QR_Code': qr_code_image_id
+        }
+        try:
+            table_order.update_item(
+                Key={'id_Pedido': order.id_Pedido},
+                UpdateExpression="set id_Pagamento = :id_Pagamento, qr_code = :qr_code, id_Imagem_QR_Code = :id_Imagem_QR_Code",
+                ExpressionAttributeValues=payment_values
+            )
+        except Exception as ex:
+            print(f"Erro ao salvar pagamento {response_payment['payment_id']} no pedido {order.id_Pedido}: {str(ex)}")
+            if cancel_pix_payment(response_payment['payment_id'], store['access_token']):
+                release_order(order)
+                return {
+                    'statusCode': 500,
+                    'body': json.dumps({'message': 'Erro ao criar pedido: pagamento cancelado, tente novamente'})
+                }
+            return {
+                'statusCode': 409,
+                'body': json.dumps({
+                    'message': 'Pagamento criado, mas o pedido não pôde ser confirmado. Não repita a requisição',
+                    'id_Pedido': order.id_Pedido,
+                    'id_Pagamento': response_payment['payment_id']
+                })
+            }
+        if existing_order is None:
+            update_store_dashboard(order.id_Loja, None, order.status_pedido, order.valor)
         return {
             'statusCode': 200,
             'body': json.dumps(
@@ -252,6 +722,128 @@ def lambda_handler(event:any, context:any):
         }
 
 
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', str(24 * 60 * 60)))
+IDEMPOTENCY_LOCK_SECONDS = int(os.environ.get('IDEMPOTENCY_LOCK_SECONDS', '60'))
+IDEMPOTENCY_LOCK_MARGIN_SECONDS = 5
+IDEMPOTENCY_IN_PROGRESS = 'EM_ANDAMENTO'
+IDEMPOTENCY_COMPLETED = 'CONCLUIDO'
+
+def get_header(event: dict, name: str):
+    for header, value in (event.get('headers') or {}).items():
+        if header.lower() == name.lower():
+            return value
+    return None
+
+def get_idempotency_key(event: dict):
+    idempotency_key = get_header(event, 'Idempotency-Key')
+    if not idempotency_key or not os.environ.get('IDEMPOTENCY_TABLE'):
+        return None
+
+    try:
+        cpf = re.sub(r'\D', '', str(json.loads(event['body']).get('fk_Usuario_cpf', '')))
+    except (KeyError, TypeError, AttributeError, ValueError):
+        return None
+    return f"{cpf}#{idempotency_key}"
+
+def get_idempotency_lease_seconds(context):
+    if context is not None and hasattr(context, 'get_remaining_time_in_millis'):
+        return max(IDEMPOTENCY_LOCK_SECONDS, math.ceil(context.get_remaining_time_in_millis() / 1000) + IDEMPOTENCY_LOCK_MARGIN_SECONDS)
+    return IDEMPOTENCY_LOCK_SECONDS
+
+def claim_idempotency_key(table_idempotency, idempotency_key: str, request_hash: str, lease_seconds: int):
+    now = int(time.time())
+    id_pedido = str(uuid.uuid4())
+    try:
+        table_idempotency.put_item(
+            Item={
+                'chave': idempotency_key,
+                'status': IDEMPOTENCY_IN_PROGRESS,
+                'hash_requisicao': request_hash,
+                'id_Pedido': id_pedido,
+                'bloqueado_ate': now + lease_seconds,
+                'expira_em': now + IDEMPOTENCY_TTL_SECONDS
+            },
+            ConditionExpression="attribute_not_exists(chave) OR expira_em < :agora",
+            ExpressionAttributeValues={':agora': now}
+        )
+        return None, id_pedido, False
+    except ClientError as err:
+        if err.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+
+    try:
+        record = table_idempotency.update_item(
+            Key={'chave': idempotency_key},
+            UpdateExpression="set bloqueado_ate = :bloqueado_ate",
+            ConditionExpression="#status = :em_andamento AND bloqueado_ate < :agora AND hash_requisicao = :hash",
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues={
+                ':bloqueado_ate': now + lease_seconds,
+                ':agora': now,
+                ':em_andamento': IDEMPOTENCY_IN_PROGRESS,
+                ':hash': request_hash
+            },
+            ReturnValues='ALL_NEW'
+        )['Attributes']
+        print(f"Retomando Idempotency-Key {idempotency_key} com lease expirado (pedido {record.get('id_Pedido')})")
+        return None, record.get('id_Pedido'), True
+    except ClientError as err:
+        if err.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+
+    record = table_idempotency.get_item(Key={'chave': idempotency_key}, ConsistentRead=True).get('Item', {})
+    if record.get('hash_requisicao') != request_hash:
+        return {
+            'statusCode': 422,
+            'body': json.dumps({'message': 'Idempotency-Key já utilizada com outro pedido'})
+        }, None, False
+    if record.get('status') == IDEMPOTENCY_COMPLETED:
+        print(f"Resposta reaproveitada para a Idempotency-Key {idempotency_key}")
+        return json.loads(record['resposta']), None, False
+    return {
+        'statusCode': 409,
+        'body': json.dumps({'message': 'Pedido com esta Idempotency-Key ainda está em processamento'})
+    }, None, False
+
+def save_idempotent_response(table_idempotency, idempotency_key: str, response: dict):
+    try:
+        if response['statusCode'] >= 500:
+            table_idempotency.delete_item(Key={'chave': idempotency_key})
+            return
+
+        table_idempotency.update_item(
+            Key={'chave': idempotency_key},
+            UpdateExpression="set #status = :concluido, resposta = :resposta",
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues={':concluido': IDEMPOTENCY_COMPLETED, ':resposta': json.dumps(response)}
+        )
+    except Exception as ex:
+        print(f"Erro ao salvar resposta da Idempotency-Key {idempotency_key}: {str(ex)}")
+
+def lambda_handler(event:any, context:any):
+    idempotency_key = get_idempotency_key(event)
+    if idempotency_key is None:
+        return process_order(event)
+
+    table_idempotency = boto3.resource('dynamodb').Table(os.environ['IDEMPOTENCY_TABLE'])
+    request_hash = hashlib.sha256(event['body'].encode('utf-8')).hexdigest()
+
+    try:
+        stored_response, id_pedido, resume = claim_idempotency_key(table_idempotency, idempotency_key, request_hash, get_idempotency_lease_seconds(context))
+    except Exception as ex:
+        print(f"Erro ao verificar Idempotency-Key {idempotency_key}: {str(ex)}")
+        return {
+            'statusCode': 500,
+            'body': json.dumps({'message': 'Erro ao criar pedido: ' + str(ex)}, default=str)
+        }
+    if stored_response is not None:
+        return stored_response
+
+    response = process_order(event, id_pedido, resume)
+    save_idempotent_response(table_idempotency, idempotency_key, response)
+    return response
+
+
 if __name__ == "__main__":
     os.environ['TABLE_USER'] = ''
     os.environ['TABLE_LOTE'] = ''
@@ -259,7 +851,14 @@ if __name__ == "__main__":
     os.environ['TABLE_ITEM_ORDER'] = ''
     os.environ['TABLE_PRODUCT'] = ''
     os.environ['STORE_ADDRESS_TABLE'] = ''
+    os.environ['BUCKET_NAME_QR_CODE'] = ''
+    os.environ['TABLE_STORE_DASHBOARD'] = ''
+    os.environ['PIX_PAYMENT_QUEUE_URL'] = ''
+    os.environ['PIX_PAYMENT_LOCAL_QUEUE'] = ''
+    os.environ['SQS_ENDPOINT_URL'] = ''
+    os.environ['IDEMPOTENCY_TABLE'] = ''
     event = {
+        "headers": {"Idempotency-Key": str(uuid.uuid4())},
         "body": json.dumps({
             "fk_Usuario_cpf": "",
             "valor": 180.0,
@@ -280,4 +879,4 @@ if __name__ == "__main__":
             
         })
     }
-    print(lambda_handler(event, None))
\ No newline at end of file
+    print(lambda_handler(event, None))
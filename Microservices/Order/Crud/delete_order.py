@@ -1,6 +1,52 @@
 import json
 import os
 import boto3
+import datetime
+from zoneinfo import ZoneInfo
+
+DASHBOARD_PAID_STATUS = 'Pago'
+DASHBOARD_REVERSED_STATUSES = ('Reembolsado', 'Chargeback')
+
+def update_store_dashboard(store_id, old_status: str, new_status: str, valor, faturamento_em: str = None):
+    table_name = os.environ.get('TABLE_STORE_DASHBOARD')
+    if not table_name or store_id is None or old_status == new_status:
+        return
+
+    now = datetime.datetime.now(ZoneInfo("America/Sao_Paulo"))
+    add_expressions = []
+    attribute_names = {}
+    attribute_values = {':atualizado_em': now.strftime("%Y-%m-%d %H:%M:%S")}
+
+    if new_status:
+        add_expressions.append("#status_novo :um")
+        attribute_names['#status_novo'] = f"qtd_{new_status}"
+        attribute_values[':um'] = 1
+    if old_status:
+        add_expressions.append("#status_antigo :menos_um")
+        attribute_names['#status_antigo'] = f"qtd_{old_status}"
+        attribute_values[':menos_um'] = -1
+
+    revenue = None
+    if faturamento_em and valor is not None:
+        if new_status == DASHBOARD_PAID_STATUS:
+            revenue = valor
+        elif new_status in DASHBOARD_REVERSED_STATUSES:
+            revenue = -valor
+
+    if revenue is not None:
+        add_expressions.append("#faturamento :faturamento")
+        attribute_names['#faturamento'] = f"faturamento_{faturamento_em}"
+        attribute_values[':faturamento'] = revenue
+
+    try:
+        boto3.resource('dynamodb').Table(table_name).update_item(
+            Key={'id_Loja': store_id},
+            UpdateExpression="SET atualizado_em = :atualizado_em ADD " + ", ".join(add_expressions),
+            ExpressionAttributeNames=attribute_names,
+            ExpressionAttributeValues=attribute_values
+        )
+    except Exception as ex:
+        print(f"Erro ao atualizar painel da loja {store_id}: {str(ex)}")
 
 def lambda_handler(event:any, context:any):
     try:
@@ -18,6 +64,8 @@ def lambda_handler(event:any, context:any):
 
         if 'Item' in response:
             table_order.delete_item(Key={'id_Pedido': id_pedido})
+            order = response['Item']
+            update_store_dashboard(order.get('fk_id_Endereco'), order.get('status_pedido'), None, order.get('valor'))
             print(f"Pedido deletado com sucesso: {id_pedido}")
             return {
                 'statusCode': 200,
@@ -45,6 +93,7 @@ def lambda_handler(event:any, context:any):
 
 if __name__ == "__main__":
     os.environ['TABLE_ORDER'] = ''
+    os.environ['TABLE_STORE_DASHBOARD'] = ''
     event = {
         "queryStringParameters": {
             "id_Pedido": ""
@@ -1,12 +1,82 @@
 import json
 import boto3
 import os
+import datetime
+import time
+import threading
+import concurrent.futures
+from collections import OrderedDict
 from dataclasses import dataclass
 from decimal import Decimal
 
-PRODUCT_CACHE = {}
-LOTE_CACHE = {}
-IMAGE_CACHE = {}
+class TTLCache:
+    def __init__(self, namespace: str, max_size: int, ttl_seconds: float):
+        env_prefix = f"CACHE_{namespace.upper()}"
+        self.namespace = namespace
+        self.max_size = int(os.environ.get(f"{env_prefix}_MAX_SIZE", max_size))
+        self.ttl_seconds = float(os.environ.get(f"{env_prefix}_TTL_SECONDS", ttl_seconds))
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.items.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self.items[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self.items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.items[key] = (value, time.monotonic() + self.ttl_seconds)
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self.lock:
+            self.items.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+    def stats(self) -> dict:
+        return {
+            "namespace": self.namespace,
+            "size": len(self.items),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+
+PRODUCT_CACHE = TTLCache("product", max_size=1000, ttl_seconds=300)
+LOTE_CACHE = TTLCache("lote", max_size=1000, ttl_seconds=60)
+IMAGE_CACHE = TTLCache("image", max_size=2000, ttl_seconds=3600)
+PAGE_CACHE = TTLCache("page", max_size=100, ttl_seconds=30)
+CACHES = (PRODUCT_CACHE, LOTE_CACHE, IMAGE_CACHE, PAGE_CACHE)
+
+ORDER_PAGE_PREFETCH = os.environ.get('ORDER_PAGE_PREFETCH', 'false').lower() == 'true'
+PREFETCH_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+PREFETCH_IN_FLIGHT = set()
+PREFETCH_LOCK = threading.Lock()
+THREAD_LOCAL = threading.local()
 
 dynamodb = boto3.resource('dynamodb')
 s3_client = boto3.client('s3')
@@ -36,8 +106,8 @@ class OrderResponse:
     AvaliacaoFeita: bool = False
     produtos: list[ProductResponse] = None
 
-    def to_dict(self):
-        return {
+    def to_dict(self, fields: list = None):
+        order_dict = {
             'id_Pedido': self.id_Pedido,
             'status_pedido': self.status_pedido,
             'valor_total': float(self.valor_total) if isinstance(self.valor_total, Decimal) else self.valor_total,
@@ -45,10 +115,83 @@ class OrderResponse:
             'AvaliacaoFeita': self.AvaliacaoFeita,
             'produtos': [p.to_dict() for p in self.produtos] if self.produtos else []
         }
+        if fields:
+            return {field: order_dict[field] for field in fields}
+        return order_dict
+
+ORDER_RESPONSE_FIELDS = {
+    'id_Pedido': ('id_Pedido',),
+    'status_pedido': ('status_pedido',),
+    'valor_total': ('valor',),
+    'data_pedido': ('data_pedido',),
+    'AvaliacaoFeita': ('AvaliacaoFeita',),
+    'produtos': ()
+}
+
+def parse_fields(fields_param: str):
+    if not fields_param:
+        return None
+
+    fields = ['id_Pedido']
+    for field in fields_param.split(','):
+        field = field.strip()
+        if not field or field in fields:
+            continue
+        if field not in ORDER_RESPONSE_FIELDS:
+            raise ValueError(f"Campo inválido em fields: {field}")
+        fields.append(field)
+    return fields
+
+def get_order_projection(fields: list):
+    attributes = sorted({attribute for field in fields for attribute in ORDER_RESPONSE_FIELDS[field]})
+    names = {f'#f{i}': attribute for i, attribute in enumerate(attributes)}
+    return ', '.join(names.keys()), names
+
+def parse_date_param(value: str, name: str, end_of_day: bool = False):
+    if not value:
+        return None
+
+    for date_format in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d'):
+        try:
+            datetime.datetime.strptime(value, date_format)
+        except ValueError:
+            continue
+        if date_format == '%Y-%m-%d' and end_of_day:
+            return f'{value} 23:59:59'
+        return value
+
+    raise ValueError(f"Parâmetro {name} inválido, use AAAA-MM-DD ou AAAA-MM-DD HH:MM:SS")
+
+def build_order_key_condition(partition_key: str, partition_value, status: str, date_from: str, date_to: str):
+    key_condition = boto3.dynamodb.conditions.Key(partition_key).eq(partition_value)
+
+    if status:
+        sort_key = boto3.dynamodb.conditions.Key('status_data_pedido')
+        if date_from or date_to:
+            key_condition &= sort_key.between(f"{status}#{date_from or ''}", f"{status}#{date_to or '9999-12-31 23:59:59'}")
+        else:
+            key_condition &= sort_key.begins_with(f'{status}#')
+        return f'{partition_key}-status_data_pedido-index', key_condition
+
+    sort_key = boto3.dynamodb.conditions.Key('data_pedido')
+    if date_from and date_to:
+        key_condition &= sort_key.between(date_from, date_to)
+    elif date_from:
+        key_condition &= sort_key.gte(date_from)
+    elif date_to:
+        key_condition &= sort_key.lte(date_to)
+    else:
+        return f'{partition_key}-index', key_condition
+    return f'{partition_key}-data_pedido-index', key_condition
 
 def get_table(table_env_var):
     table_name = os.environ[table_env_var]
-    return dynamodb.Table(table_name)
+    if threading.current_thread() is threading.main_thread():
+        return dynamodb.Table(table_name)
+
+    if not hasattr(THREAD_LOCAL, 'dynamodb'):
+        THREAD_LOCAL.dynamodb = boto3.session.Session().resource('dynamodb')
+    return THREAD_LOCAL.dynamodb.Table(table_name)
 
 def convert_decimal_values(item):
     if isinstance(item, dict):
@@ -60,30 +203,32 @@ def convert_decimal_values(item):
     return item
 
 def get_lote(lote_id: str):
-    if lote_id in LOTE_CACHE:
-        return LOTE_CACHE[lote_id]
+    cached = LOTE_CACHE.get(lote_id)
+    if cached is not None:
+        return cached
     
     table_lote = get_table('TABLE_LOTE')
     response_lote = table_lote.get_item(Key={'id_Lote': lote_id})
     
     if 'Item' in response_lote:
         item = convert_decimal_values(response_lote['Item'])
-        LOTE_CACHE[lote_id] = item
+        LOTE_CACHE.set(lote_id, item)
         return item
     
     print(f"Nenhum lote encontrado com o id: {lote_id}")
     return None
 
 def get_product(product_id: str):
-    if product_id in PRODUCT_CACHE:
-        return PRODUCT_CACHE[product_id]
+    cached = PRODUCT_CACHE.get(product_id)
+    if cached is not None:
+        return cached
     
     table_product = get_table('TABLE_PRODUCT')
     response_product = table_product.get_item(Key={'id_Produto': product_id})
     
     if 'Item' in response_product:
         item = convert_decimal_values(response_product['Item'])
-        PRODUCT_CACHE[product_id] = item
+        PRODUCT_CACHE.set(product_id, item)
         return item
     
     print(f"Nenhum produto encontrado com o id: {product_id}")
@@ -104,14 +249,15 @@ def get_image(id_imagem: str):
     if not id_imagem:
         return None
     
-    if id_imagem in IMAGE_CACHE:
-        return IMAGE_CACHE[id_imagem]
+    cached = IMAGE_CACHE.get(id_imagem)
+    if cached is not None:
+        return cached
     
     try:
         bucket_name = os.environ['BUCKET_NAME']
         image_url = f"https://{bucket_name}.s3.amazonaws.com/{id_imagem}"
         
-        IMAGE_CACHE[id_imagem] = image_url
+        IMAGE_CACHE.set(id_imagem, image_url)
         return image_url
     except Exception as ex:
         print(f"Erro ao buscar imagem com id: {id_imagem}: {str(ex)}")
@@ -150,6 +296,15 @@ def get_order_products(order: OrderResponse):
     product_list = []
     for item in items:
         lote_id = item['fk_id_Lote']
+
+        if item.get('nome_produto') is not None:
+            product_list.append(ProductResponse(
+                nome_produto=item['nome_produto'],
+                imagem_produto=get_image(item.get('id_imagem_produto')),
+                quantidade=item['quantidade_item'],
+                valor_unitario=item['preco_unitario']
+            ))
+            continue
         
         product_response = ProductResponse(
             nome_produto=get_product_name(lote_id),
@@ -161,6 +316,56 @@ def get_order_products(order: OrderResponse):
     
     return product_list
     
+def load_order_page(query_params_dynamo: dict, fields: list, include_products: bool):
+    response_orders = get_table('TABLE_ORDER').query(**query_params_dynamo)
+
+    orders = [convert_decimal_values(order) for order in response_orders.get('Items', [])]
+    order_list = []
+
+    for order in orders:
+        order_response = OrderResponse(
+            id_Pedido=order['id_Pedido'],
+            status_pedido=order.get('status_pedido'),
+            valor_total=order.get('valor'),
+            data_pedido=order.get('data_pedido'),
+            AvaliacaoFeita=order.get('AvaliacaoFeita', False)
+        )
+        order_list.append(order_response)
+
+    if include_products:
+        for order_resp in order_list:
+            produtos = get_order_products(order_resp)
+            if produtos:
+                order_resp.produtos = produtos
+
+    next_token = None
+    if 'LastEvaluatedKey' in response_orders:
+        last_key = convert_decimal_values(response_orders['LastEvaluatedKey'])
+        next_token = json.dumps(last_key)
+
+    return [order.to_dict(fields) for order in order_list], next_token
+
+def prefetch_order_page(page_key: tuple, next_token: str, query_params_dynamo: dict, fields: list, include_products: bool):
+    cache_key = page_key + (next_token,)
+    with PREFETCH_LOCK:
+        if cache_key in PREFETCH_IN_FLIGHT:
+            return
+        PREFETCH_IN_FLIGHT.add(cache_key)
+
+    params = dict(query_params_dynamo)
+    params['ExclusiveStartKey'] = json.loads(next_token)
+
+    def run():
+        try:
+            PAGE_CACHE.set(cache_key, load_order_page(params, fields, include_products))
+        except Exception as ex:
+            print(f"Erro ao pré-carregar página de pedidos: {str(ex)}")
+        finally:
+            with PREFETCH_LOCK:
+                PREFETCH_IN_FLIGHT.discard(cache_key)
+
+    PREFETCH_EXECUTOR.submit(run)
+
 def lambda_handler(event: any, context: any): 
     try:
         query_params = event.get('queryStringParameters', {}) or {}
@@ -168,6 +373,21 @@ def lambda_handler(event: any, context: any):
         
         limit = int(query_params.get('limit', '10'))
         include_products = query_params.get('include_products', 'true').lower() == 'true'
+
+        try:
+            fields = parse_fields(query_params.get('fields'))
+            status = query_params.get('status')
+            date_from = parse_date_param(query_params.get('from'), 'from')
+            date_to = parse_date_param(query_params.get('to'), 'to', end_of_day=True)
+        except ValueError as err:
+            print(str(err))
+            return {
+                "statusCode": 400,
+                "body": json.dumps({"message": str(err)})
+            }
+
+        if fields:
+            include_products = 'produtos' in fields
         
         try:
             store_id = int(store_id) if store_id else None
@@ -185,53 +405,56 @@ def lambda_handler(event: any, context: any):
                 "body": json.dumps({"message": "ID da loja não fornecido."})
             }
         
-        table_order = get_table('TABLE_ORDER')
+        index_name, key_condition = build_order_key_condition('fk_id_Endereco', store_id, status, date_from, date_to)
         query_params_dynamo = {
-            'IndexName': 'fk_id_Endereco-index',
-            'KeyConditionExpression': boto3.dynamodb.conditions.Key('fk_id_Endereco').eq(store_id),
+            'IndexName': index_name,
+            'KeyConditionExpression': key_condition,
             'Limit': limit
         }
+
+        if fields:
+            projection, attribute_names = get_order_projection(fields)
+            query_params_dynamo['ProjectionExpression'] = projection
+            query_params_dynamo['ExpressionAttributeNames'] = attribute_names
         
-        response_orders = table_order.query(**query_params_dynamo)
+        page_key = (store_id, status, date_from, date_to, limit, tuple(fields) if fields else None, include_products)
+        last_evaluated_key_str = query_params.get('nextToken')
+
+        cached_page = PAGE_CACHE.get(page_key + (last_evaluated_key_str,)) if ORDER_PAGE_PREFETCH else None
+        if cached_page is not None:
+            pedidos, next_token = cached_page
+        else:
+            if last_evaluated_key_str:
+                try:
+                    query_params_dynamo['ExclusiveStartKey'] = json.loads(last_evaluated_key_str)
+                except json.JSONDecodeError:
+                    print(f"nextToken inválido: {last_evaluated_key_str}")
+                    return {
+                        "statusCode": 400,
+                        "body": json.dumps({"message": "nextToken inválido"})
+                    }
+
+            pedidos, next_token = load_order_page(query_params_dynamo, fields, include_products)
 
-        if 'Items' not in response_orders or len(response_orders['Items']) == 0:
+        if not pedidos and not last_evaluated_key_str:
             print(f"Nenhum pedido encontrado para a loja: {store_id}")
             return {
                 "statusCode": 404,
                 "body": json.dumps({"message": f"Nenhum pedido encontrado para a loja: {store_id}"})
             }
-        
-        orders = [convert_decimal_values(order) for order in response_orders['Items']]
-        order_list = []
-        
-        for order in orders:
-            order_response = OrderResponse(
-                id_Pedido=order['id_Pedido'],
-                status_pedido=order['status_pedido'],
-                valor_total=order['valor'],
-                data_pedido=order['data_pedido'],
-                AvaliacaoFeita=order.get('AvaliacaoFeita', False)
-            )
-            order_list.append(order_response)
-        
-        if include_products:
-            for order_resp in order_list:
-                produtos = get_order_products(order_resp)
-                if produtos:
-                    order_resp.produtos = produtos
-
-        next_token = None
-        if 'LastEvaluatedKey' in response_orders:
-            last_key = convert_decimal_values(response_orders['LastEvaluatedKey'])
-            next_token = json.dumps(last_key)
-        
+
+        if ORDER_PAGE_PREFETCH and next_token:
+            prefetch_order_page(page_key, next_token, query_params_dynamo, fields, include_products)
+
         response_body = {
-            "pedidos": [order.to_dict() for order in order_list]
+            "pedidos": pedidos
         }
         
         if next_token:
             response_body["nextToken"] = next_token
 
+        print(f"Caches: {[cache.stats() for cache in CACHES]}")
+
         return {
             "statusCode": 200,
             "body": json.dumps(response_body)
@@ -1,18 +1,98 @@
 import json
 import os
+import datetime
 import boto3
+import time
+import threading
+import concurrent.futures
+import itertools
+import uuid
+from collections import OrderedDict
 from dataclasses import dataclass, asdict
 from decimal import Decimal
+from functools import partial
 import mercadopago
 
-PRODUCT_CACHE = {}
-STORE_CACHE = {}
-LOTE_CACHE = {}
-IMAGE_CACHE = {}
-QR_CODE_CACHE = {}
-MP_SDK_INSTANCES = {}
+class TTLCache:
+    def __init__(self, namespace: str, max_size: int, ttl_seconds: float):
+        env_prefix = f"CACHE_{namespace.upper()}"
+        self.namespace = namespace
+        self.max_size = int(os.environ.get(f"{env_prefix}_MAX_SIZE", max_size))
+        self.ttl_seconds = float(os.environ.get(f"{env_prefix}_TTL_SECONDS", ttl_seconds))
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.items.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self.items[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self.items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.items[key] = (value, time.monotonic() + self.ttl_seconds)
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self.lock:
+            self.items.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+    def stats(self) -> dict:
+        return {
+            "namespace": self.namespace,
+            "size": len(self.items),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+
+PRODUCT_CACHE = TTLCache("product", max_size=1000, ttl_seconds=300)
+STORE_CACHE = TTLCache("store", max_size=500, ttl_seconds=300)
+LOTE_CACHE = TTLCache("lote", max_size=1000, ttl_seconds=60)
+IMAGE_CACHE = TTLCache("image", max_size=2000, ttl_seconds=3600)
+QR_CODE_CACHE = TTLCache("qr_code", max_size=1000, ttl_seconds=3600)
+MP_SDK_INSTANCES = TTLCache("mp_sdk", max_size=100, ttl_seconds=3600)
+CACHES = (PRODUCT_CACHE, STORE_CACHE, LOTE_CACHE, IMAGE_CACHE, QR_CODE_CACHE, MP_SDK_INSTANCES)
+
+BATCH_GET_MAX_KEYS = 100
+BATCH_GET_MAX_RETRIES = 5
+
+ORDER_FANOUT_MAX_WORKERS = int(os.environ.get("ORDER_FANOUT_MAX_WORKERS", "8"))
+ORDER_FANOUT_DEADLINE_SECONDS = float(os.environ.get("ORDER_FANOUT_DEADLINE_SECONDS", "10"))
+ORDER_FANOUT_SAFETY_MARGIN_SECONDS = 1.0
+FANOUT_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, ORDER_FANOUT_MAX_WORKERS))
+
+ORDER_EXPORT_PAGE_SIZE = int(os.environ.get("ORDER_EXPORT_PAGE_SIZE", "100"))
+ORDER_EXPORT_CHUNK_BYTES = max(int(os.environ.get("ORDER_EXPORT_CHUNK_BYTES", str(5 * 1024 * 1024))), 5 * 1024 * 1024)
+ORDER_EXPORT_INLINE_MAX_BYTES = int(os.environ.get("ORDER_EXPORT_INLINE_MAX_BYTES", str(1024 * 1024)))
+ORDER_EXPORT_URL_TTL_SECONDS = int(os.environ.get("ORDER_EXPORT_URL_TTL_SECONDS", "3600"))
 
 dynamodb = boto3.resource("dynamodb")
+dynamodb_client = dynamodb.meta.client
 s3_client = boto3.client("s3")
 
 def decimal_serializer(obj):
@@ -48,11 +128,108 @@ class OrderResponse:
     data_pedido: str
     AvaliacaoFeita: bool = False
     qr_code: str = None
+    imagem_qr_code: str = None
     produtos: list[ProductResponse] = None
 
+ORDER_RESPONSE_FIELDS = {
+    "id_Pedido": ("id_Pedido",),
+    "id_Pagamento": ("id_Pagamento",),
+    "status_pedido": ("status_pedido",),
+    "valor_total": ("valor",),
+    "data_pedido": ("data_pedido",),
+    "AvaliacaoFeita": ("AvaliacaoFeita",),
+    "qr_code": ("qr_code", "id_Pagamento", "fk_id_Endereco"),
+    "imagem_qr_code": ("id_Imagem_QR_Code",),
+    "produtos": ()
+}
+
+def parse_fields(fields_param: str):
+    if not fields_param:
+        return None
+
+    fields = ["id_Pedido"]
+    for field in fields_param.split(","):
+        field = field.strip()
+        if not field or field in fields:
+            continue
+        if field not in ORDER_RESPONSE_FIELDS:
+            raise ValueError(f"Campo inválido em fields: {field}")
+        fields.append(field)
+    return fields
+
+def get_order_projection(fields: list):
+    attributes = sorted({attribute for field in fields for attribute in ORDER_RESPONSE_FIELDS[field]})
+    names = {f"#f{i}": attribute for i, attribute in enumerate(attributes)}
+    return ", ".join(names.keys()), names
+
+def parse_date_param(value: str, name: str, end_of_day: bool = False):
+    if not value:
+        return None
+
+    for date_format in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
+        try:
+            datetime.datetime.strptime(value, date_format)
+        except ValueError:
+            continue
+        if date_format == "%Y-%m-%d" and end_of_day:
+            return f"{value} 23:59:59"
+        return value
+
+    raise ValueError(f"Parâmetro {name} inválido, use AAAA-MM-DD ou AAAA-MM-DD HH:MM:SS")
+
+def build_order_key_condition(partition_key: str, partition_value, status: str, date_from: str, date_to: str):
+    key_condition = boto3.dynamodb.conditions.Key(partition_key).eq(partition_value)
+
+    if status:
+        sort_key = boto3.dynamodb.conditions.Key("status_data_pedido")
+        if date_from or date_to:
+            key_condition &= sort_key.between(f"{status}#{date_from or ''}", f"{status}#{date_to or '9999-12-31 23:59:59'}")
+        else:
+            key_condition &= sort_key.begins_with(f"{status}#")
+        return f"{partition_key}-status_data_pedido-index", key_condition
+
+    sort_key = boto3.dynamodb.conditions.Key("data_pedido")
+    if date_from and date_to:
+        key_condition &= sort_key.between(date_from, date_to)
+    elif date_from:
+        key_condition &= sort_key.gte(date_from)
+    elif date_to:
+        key_condition &= sort_key.lte(date_to)
+    else:
+        return f"{partition_key}-index", key_condition
+    return f"{partition_key}-data_pedido-index", key_condition
+
 def get_table(table_env_var):
-    table_name = os.environ[table_env_var]
-    return dynamodb.Table(table_name)
+    return dynamodb.Table(os.environ[table_env_var])
+
+def get_fanout_deadline(context):
+    timeout = ORDER_FANOUT_DEADLINE_SECONDS
+    if context is not None and hasattr(context, "get_remaining_time_in_millis"):
+        remaining = context.get_remaining_time_in_millis() / 1000 - ORDER_FANOUT_SAFETY_MARGIN_SECONDS
+        timeout = min(timeout, max(remaining, 0))
+    return time.monotonic() + timeout
+
+def fan_out(tasks: dict, deadline: float = None):
+    if not tasks:
+        return {}
+
+    results = {}
+    futures = {FANOUT_EXECUTOR.submit(task): key for key, task in tasks.items()}
+    timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+    try:
+        for future in concurrent.futures.as_completed(futures, timeout=timeout):
+            key = futures[future]
+            try:
+                results[key] = future.result()
+            except Exception as ex:
+                print(f"Erro ao executar tarefa {key}: {str(ex)}")
+    except concurrent.futures.TimeoutError:
+        print(f"Prazo excedido: {len(futures) - len(results)} de {len(futures)} tarefas não concluídas")
+    finally:
+        for future in futures:
+            future.cancel()
+
+    return results
 
 def convert_decimal_values(item):
     if isinstance(item, dict):
@@ -68,79 +245,78 @@ def get_store_image(id_imagem: str):
         return None
         
     cache_key = f"store:{id_imagem}"
-    if cache_key in IMAGE_CACHE:
-        return IMAGE_CACHE[cache_key]
+    cached = IMAGE_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
     
     try:
         bucket_name = os.environ["BUCKET_NAME_STORE"]
         image_url = f"https://{bucket_name}.s3.amazonaws.com/{id_imagem}"
-        IMAGE_CACHE[cache_key] = image_url
+        IMAGE_CACHE.set(cache_key, image_url)
         return image_url
     except Exception as ex:
         print(f"Erro ao buscar imagem com id: {id_imagem}: {str(ex)}")
         return None
 
-def get_lote(lote_id: str):
-    if lote_id in LOTE_CACHE:
-        return LOTE_CACHE[lote_id]
-    
-    table_lote = get_table("TABLE_LOTE")
-    response_lote = table_lote.get_item(Key={"id_Lote": lote_id})
-    
-    if "Item" in response_lote:
-        item = convert_decimal_values(response_lote["Item"])
-        LOTE_CACHE[lote_id] = item
-        return item
-    
-    print(f"Nenhum lote encontrado com o id: {lote_id}")
-    return None
+def batch_get_items(table_env_var: str, key_name: str, keys, cache: TTLCache):
+    table_name = os.environ[table_env_var]
+    results = {}
+    missing = {}
+    for key in keys:
+        cache_key = str(key)
+        if cache_key in results or cache_key in missing:
+            continue
 
-def get_product(product_id: str):
-    if product_id in PRODUCT_CACHE:
-        return PRODUCT_CACHE[product_id]
-    
-    table_product = get_table("TABLE_PRODUCT")
-    response_product = table_product.get_item(Key={"id_Produto": product_id})
-    
-    if "Item" in response_product:
-        item = convert_decimal_values(response_product["Item"])
-        PRODUCT_CACHE[product_id] = item
-        return item
-    
-    print(f"Nenhum produto encontrado com o id: {product_id}")
-    return None
+        cached = cache.get(cache_key)
+        if cached is not None:
+            results[cache_key] = cached
+        else:
+            missing[cache_key] = key
+
+    pending = list(missing.values())
+    for start in range(0, len(pending), BATCH_GET_MAX_KEYS):
+        request_items = {table_name: {"Keys": [{key_name: key} for key in pending[start:start + BATCH_GET_MAX_KEYS]]}}
+        attempt = 0
+        while request_items:
+            response = dynamodb.batch_get_item(RequestItems=request_items)
+            for item in response.get("Responses", {}).get(table_name, []):
+                item = convert_decimal_values(item)
+                cache_key = str(item[key_name])
+                cache.set(cache_key, item)
+                results[cache_key] = item
+
+            request_items = response.get("UnprocessedKeys") or {}
+            if request_items:
+                attempt += 1
+                if attempt > BATCH_GET_MAX_RETRIES:
+                    print(f"Chaves não processadas em {table_name} após {BATCH_GET_MAX_RETRIES} tentativas")
+                    break
+                time.sleep(0.05 * (2 ** attempt))
+
+    for cache_key in missing:
+        if cache_key not in results:
+            print(f"Nenhum item encontrado em {table_name} com {key_name}: {cache_key}")
+
+    return results
 
 def get_store(store_id: str):
     store_id_str = str(store_id) 
-    if store_id_str in STORE_CACHE:
-        return STORE_CACHE[store_id_str]
+    cached = STORE_CACHE.get(store_id_str)
+    if cached is not None:
+        return cached
     
-    table_store = get_table("TABLE_STORE")
-    response_store = table_store.get_item(Key={"id_Endereco": store_id})
+    response_store = dynamodb_client.get_item(TableName=os.environ["TABLE_STORE"], Key={"id_Endereco": store_id})
     
     if "Item" in response_store:
         item = convert_decimal_values(response_store["Item"])
-        STORE_CACHE[store_id_str] = item
+        STORE_CACHE.set(store_id_str, item)
         return item
     
     print(f"Nenhuma loja encontrada com o id: {store_id_str}")
     return None
 
-def get_product_store(lote_id: str):
-    lote = get_lote(lote_id)
-    if not lote:
-        return None
-    
-    product = get_product(lote["fk_id_Produto"])
-    if not product:
-        return None
-    
-    store_id = product["fk_id_Endereco"]
-    store = get_store(store_id)
-    if not store:
-        return None
-    
-    store_response = StoreResponse(
+def build_store_response(store: dict):
+    return StoreResponse(
         id_loja=str(store["id_Endereco"]),
         nome_loja=store["nome_Loja"],
         imagem_loja=get_store_image(store.get("id_Imagem")),
@@ -148,65 +324,57 @@ def get_product_store(lote_id: str):
         cep_loja=store["cep"],
         tipo_entrega=store["tipo_Entrega"]
     )
-    
-    return store_response
 
-def get_product_name(lote_id: str):
-    lote = get_lote(lote_id)
-    if not lote:
+def get_qr_code_image(id_imagem: str):
+    if not id_imagem:
         return None
-    
-    product = get_product(lote["fk_id_Produto"])
-    if not product:
+
+    bucket_name = os.environ.get("BUCKET_NAME_QR_CODE")
+    if not bucket_name:
         return None
-    
-    return product["nome"]
+
+    return f"https://{bucket_name}.s3.amazonaws.com/{id_imagem}"
 
 def get_image(id_imagem: str):
     if not id_imagem:
         return None
         
     cache_key = f"product:{id_imagem}"
-    if cache_key in IMAGE_CACHE:
-        return IMAGE_CACHE[cache_key]
+    cached = IMAGE_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
     
     try:
         bucket_name = os.environ["BUCKET_NAME_PRODUCT"]
         image_url = f"https://{bucket_name}.s3.amazonaws.com/{id_imagem}"
-        IMAGE_CACHE[cache_key] = image_url
+        IMAGE_CACHE.set(cache_key, image_url)
         return image_url
     except Exception as ex:
         print(f"Erro ao buscar imagem com id: {id_imagem}: {str(ex)}")
         return None
 
-def get_product_image(lote_id: str):
-    lote = get_lote(lote_id)
-    if not lote:
-        return None
-    
-    product = get_product(lote["fk_id_Produto"])
-    if not product:
-        return None
-    
-    return get_image(product.get("id_imagem"))
-
 def get_mp_sdk(access_token):
-    if access_token in MP_SDK_INSTANCES:
-        return MP_SDK_INSTANCES[access_token]
+    cached = MP_SDK_INSTANCES.get(access_token)
+    if cached is not None:
+        return cached
     
     sdk = mercadopago.SDK(access_token)
-    MP_SDK_INSTANCES[access_token] = sdk
+    MP_SDK_INSTANCES.set(access_token, sdk)
     return sdk
 
 def get_order_qr_code(order: dict):
+    if order.get("qr_code"):
+        return order["qr_code"]
+
     payment_id = order.get("id_Pagamento")
     if not payment_id:
         print("ID de Pagamento não encontrado no pedido para buscar QR Code.")
         return None
         
     cache_key = str(payment_id)
-    if cache_key in QR_CODE_CACHE:
-        return QR_CODE_CACHE[cache_key]
+    cached = QR_CODE_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
     
     try:
         store_id = order.get("fk_id_Endereco")
@@ -230,7 +398,7 @@ def get_order_qr_code(order: dict):
         if payment and payment.get("status") == 200 and payment.get("response"):
             qr_code = payment["response"].get("point_of_interaction", {}).get("transaction_data", {}).get("qr_code")
             if qr_code:
-                QR_CODE_CACHE[cache_key] = qr_code
+                QR_CODE_CACHE.set(cache_key, qr_code)
                 return qr_code
             else:
                 print(f"QR code não encontrado na resposta do MP para pagamento {payment_id}.")
@@ -243,9 +411,8 @@ def get_order_qr_code(order: dict):
         return None
 
 def get_order_items(order_id: str):
-    table_item_order = get_table("TABLE_ITEM_ORDER")
-    
-    response_item_order = table_item_order.query(
+    response_item_order = dynamodb_client.query(
+        TableName=os.environ["TABLE_ITEM_ORDER"],
         IndexName="fk_id_Pedido-index",
         KeyConditionExpression=boto3.dynamodb.conditions.Key("fk_id_Pedido").eq(order_id)
     )
@@ -256,33 +423,204 @@ def get_order_items(order_id: str):
     
     return [convert_decimal_values(item) for item in response_item_order["Items"]]
 
-def get_order_products(order_response: OrderResponse):
-    items = get_order_items(order_response.id_Pedido)
-    if not items:
-        return None
+def has_item_snapshot(item: dict):
+    return item.get("nome_produto") is not None and item.get("id_loja") is not None
+
+def build_snapshot_store_response(item: dict):
+    return StoreResponse(
+        id_loja=str(item["id_loja"]),
+        nome_loja=item.get("nome_loja"),
+        imagem_loja=get_store_image(item.get("id_imagem_loja")),
+        endereco_loja=item.get("endereco_loja"),
+        cep_loja=item.get("cep_loja"),
+        tipo_entrega=item.get("tipo_entrega_loja")
+    )
+
+def hydrate_order_products(order_responses: list[OrderResponse], items_by_order: dict):
+    lote_ids = [item["fk_id_Lote"] for items in items_by_order.values() for item in items if item.get("fk_id_Lote") and not has_item_snapshot(item)]
+    lotes = batch_get_items("TABLE_LOTE", "id_Lote", lote_ids, LOTE_CACHE)
+
+    product_ids = [lote["fk_id_Produto"] for lote in lotes.values() if lote.get("fk_id_Produto")]
+    products = batch_get_items("TABLE_PRODUCT", "id_Produto", product_ids, PRODUCT_CACHE)
+
+    store_ids = [product["fk_id_Endereco"] for product in products.values() if product.get("fk_id_Endereco") is not None]
+    stores = batch_get_items("TABLE_STORE", "id_Endereco", store_ids, STORE_CACHE)
+
+    for order_response in order_responses:
+        items = items_by_order.get(order_response.id_Pedido)
+        if not items:
+            continue
+
+        product_list = []
+        for item in items:
+            if has_item_snapshot(item):
+                product_list.append(ProductResponse(
+                    nome_produto=item["nome_produto"],
+                    imagem_produto=get_image(item.get("id_imagem_produto")),
+                    quantidade=int(item.get("quantidade_item", 0)),
+                    valor_unitario=item.get("preco_unitario"),
+                    loja=build_snapshot_store_response(item)
+                ))
+                continue
+
+            lote_id = item.get("fk_id_Lote")
+            if not lote_id:
+                print(f"Item sem fk_id_Lote no pedido {order_response.id_Pedido}")
+                continue
+
+            lote = lotes.get(str(lote_id))
+            product = products.get(str(lote["fk_id_Produto"])) if lote else None
+            store = stores.get(str(product["fk_id_Endereco"])) if product else None
+            if not store:
+                print(f"Não foi possível obter dados da loja para o lote {lote_id}")
+                continue
+
+            product_response = ProductResponse(
+                nome_produto=product["nome"],
+                imagem_produto=get_image(product.get("id_imagem")),
+                quantidade=int(item.get("quantidade_item", 0)),
+                valor_unitario=item.get("preco_unitario"),
+                loja=build_store_response(store)
+            )
+            product_list.append(product_response)
+
+        order_response.produtos = product_list
+
+def build_order_page(orders: list, fields: list, include_products: bool, include_qr_code: bool, include_qr_code_image: bool, context, wait_for_all: bool = False):
+    orders_raw = [convert_decimal_values(order) for order in orders]
+    order_list = []
     
-    product_list = []
-    for item in items:
-        lote_id = item.get("fk_id_Lote")
-        if not lote_id:
-            print(f"Item sem fk_id_Lote no pedido {order_response.id_Pedido}")
+    for order_data in orders_raw:
+        order_response = OrderResponse(
+            id_Pedido=order_data["id_Pedido"],
+            id_Pagamento=str(order_data.get("id_Pagamento")),
+            status_pedido=order_data.get("status_pedido"),
+            valor_total=order_data.get("valor"),
+            data_pedido=order_data.get("data_pedido"),
+            AvaliacaoFeita=order_data.get("AvaliacaoFeita", False)
+        )
+        order_list.append(order_response)
+
+    tasks = {}
+    for order_data in orders_raw:
+        if include_qr_code and not order_data.get("qr_code"):
+            tasks[("qr_code", order_data["id_Pedido"])] = partial(get_order_qr_code, order_data)
+        if include_products:
+            tasks[("itens", order_data["id_Pedido"])] = partial(get_order_items, order_data["id_Pedido"])
+
+    results = fan_out(tasks, None if wait_for_all else get_fanout_deadline(context))
+    incomplete_orders = sorted({order_id for key, order_id in tasks if (key, order_id) not in results})
+    if incomplete_orders:
+        print(f"{len(incomplete_orders)} de {len(orders_raw)} pedidos retornados sem todos os dados: {incomplete_orders}")
+
+    for order_data, order_response in zip(orders_raw, order_list):
+        if include_qr_code:
+            order_response.qr_code = order_data.get("qr_code") or results.get(("qr_code", order_response.id_Pedido))
+        if include_qr_code_image:
+            order_response.imagem_qr_code = get_qr_code_image(order_data.get("id_Imagem_QR_Code"))
+
+    if include_products:
+        items_by_order = {
+            order_response.id_Pedido: results[("itens", order_response.id_Pedido)]
+            for order_response in order_list
+            if ("itens", order_response.id_Pedido) in results
+        }
+        hydrate_order_products(order_list, items_by_order)
+
+    pedidos = [asdict(order) for order in order_list]
+    if fields:
+        pedidos = [{field: pedido[field] for field in fields} for pedido in pedidos]
+    for order_response, pedido in zip(order_list, pedidos):
+        if order_response.id_Pedido in incomplete_orders:
+            pedido["incompleto"] = True
+    return pedidos, incomplete_orders
+
+def iter_order_pages(table_order, query_params_dynamo: dict):
+    params = dict(query_params_dynamo)
+    while True:
+        response = table_order.query(**params)
+        yield response.get("Items", [])
+
+        if "LastEvaluatedKey" not in response:
+            return
+        params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+def iter_order_export_lines(table_order, query_params_dynamo: dict, build_page):
+    for orders in iter_order_pages(table_order, query_params_dynamo):
+        if not orders:
             continue
-            
-        store_info = get_product_store(lote_id)
-        if not store_info:
-             print(f"Não foi possível obter dados da loja para o lote {lote_id}")
-             continue 
-
-        product_response = ProductResponse(
-            nome_produto=get_product_name(lote_id),
-            imagem_produto=get_product_image(lote_id),
-            quantidade=int(item.get("quantidade_item", 0)), 
-            valor_unitario=item.get("preco_unitario"),
-            loja=store_info
+        pedidos, _ = build_page(orders)
+        for pedido in pedidos:
+            yield json.dumps(pedido, default=decimal_serializer) + "\n"
+
+def iter_chunks(lines, chunk_size: int):
+    buffer = []
+    size = 0
+    for line in lines:
+        data = line.encode("utf-8")
+        buffer.append(data)
+        size += len(data)
+        if size >= chunk_size:
+            yield b"".join(buffer)
+            buffer = []
+            size = 0
+
+    if buffer:
+        yield b"".join(buffer)
+
+def upload_export(chunks, key: str):
+    bucket_name = os.environ["BUCKET_NAME_ORDER_EXPORT"]
+    upload = s3_client.create_multipart_upload(Bucket=bucket_name, Key=key, ContentType="application/x-ndjson")
+
+    parts = []
+    try:
+        for part_number, chunk in enumerate(chunks, start=1):
+            response_part = s3_client.upload_part(
+                Bucket=bucket_name,
+                Key=key,
+                PartNumber=part_number,
+                UploadId=upload["UploadId"],
+                Body=chunk
+            )
+            parts.append({"ETag": response_part["ETag"], "PartNumber": part_number})
+
+        s3_client.complete_multipart_upload(
+            Bucket=bucket_name,
+            Key=key,
+            UploadId=upload["UploadId"],
+            MultipartUpload={"Parts": parts}
         )
-        product_list.append(product_response)
-    
-    return product_list
+    except Exception:
+        s3_client.abort_multipart_upload(Bucket=bucket_name, Key=key, UploadId=upload["UploadId"])
+        raise
+
+    return s3_client.generate_presigned_url(
+        "get_object",
+        Params={"Bucket": bucket_name, "Key": key},
+        ExpiresIn=ORDER_EXPORT_URL_TTL_SECONDS
+    )
+
+def export_orders(cpf: str, table_order, query_params_dynamo: dict, build_page):
+    chunks = iter_chunks(iter_order_export_lines(table_order, query_params_dynamo, build_page), ORDER_EXPORT_CHUNK_BYTES)
+    first_chunk = next(chunks, b"")
+    second_chunk = next(chunks, None)
+
+    if second_chunk is None and len(first_chunk) <= ORDER_EXPORT_INLINE_MAX_BYTES:
+        return {
+            "statusCode": 200,
+            "headers": {"Content-Type": "application/x-ndjson"},
+            "body": first_chunk.decode("utf-8")
+        }
+
+    key = f"exportacoes/{cpf}/{uuid.uuid4()}.ndjson"
+    read_chunks = [chunk for chunk in (first_chunk, second_chunk) if chunk is not None]
+    url = upload_export(itertools.chain(read_chunks, chunks), key)
+    print(f"Exportação de pedidos do CPF {cpf} salva em {key}")
+
+    return {
+        "statusCode": 200,
+        "body": json.dumps({"url": url, "expira_em_segundos": ORDER_EXPORT_URL_TTL_SECONDS})
+    }
 
 def lambda_handler(event, context):
     try:
@@ -292,6 +630,32 @@ def lambda_handler(event, context):
         limit = int(query_params.get("limit", "10"))
         include_products = query_params.get("include_products", "true").lower() == "true"
         include_qr_code = query_params.get("include_qr_code", "true").lower() == "true"
+        include_qr_code_image = include_qr_code
+
+        try:
+            fields = parse_fields(query_params.get("fields"))
+            status = query_params.get("status")
+            date_from = parse_date_param(query_params.get("from"), "from")
+            date_to = parse_date_param(query_params.get("to"), "to", end_of_day=True)
+        except ValueError as err:
+            print(str(err))
+            return {
+                "statusCode": 400,
+                "body": json.dumps({"message": str(err)})
+            }
+
+        if fields:
+            include_products = "produtos" in fields
+            include_qr_code = "qr_code" in fields
+            include_qr_code_image = "imagem_qr_code" in fields
+
+        export_format = query_params.get("export")
+        if export_format and export_format != "ndjson":
+            print(f"Formato de exportação inválido: {export_format}")
+            return {
+                "statusCode": 400,
+                "body": json.dumps({"message": f"Formato de exportação inválido: {export_format}"})
+            }
         
         if not cpf:
             print("CPF não informado")
@@ -301,11 +665,17 @@ def lambda_handler(event, context):
             }
         
         table_order = get_table("ORDERS_TABLE")
+        index_name, key_condition = build_order_key_condition("fk_Usuario_cpf", cpf, status, date_from, date_to)
         query_params_dynamo = {
-            "IndexName": "fk_Usuario_cpf-index",
-            "KeyConditionExpression": boto3.dynamodb.conditions.Key("fk_Usuario_cpf").eq(cpf),
+            "IndexName": index_name,
+            "KeyConditionExpression": key_condition,
             "Limit": limit
         }
+
+        if fields:
+            projection, attribute_names = get_order_projection(fields)
+            query_params_dynamo["ProjectionExpression"] = projection
+            query_params_dynamo["ExpressionAttributeNames"] = attribute_names
         
         last_evaluated_key_str = query_params.get("nextToken")
         if last_evaluated_key_str:
@@ -318,6 +688,19 @@ def lambda_handler(event, context):
                     "body": json.dumps({"message": "nextToken inválido"})
                  }
 
+        if export_format:
+            query_params_dynamo["Limit"] = ORDER_EXPORT_PAGE_SIZE
+            build_page = partial(
+                build_order_page,
+                fields=fields,
+                include_products=include_products,
+                include_qr_code=include_qr_code,
+                include_qr_code_image=include_qr_code_image,
+                context=context,
+                wait_for_all=True
+            )
+            return export_orders(cpf, table_order, query_params_dynamo, build_page)
+
         response_orders = table_order.query(**query_params_dynamo)
         
         if "Items" not in response_orders or len(response_orders["Items"]) == 0:
@@ -333,41 +716,26 @@ def lambda_handler(event, context):
                     "body": json.dumps({"pedidos": [], "nextToken": None})
                  }
 
-        orders_raw = [convert_decimal_values(order) for order in response_orders["Items"]]
-        order_list = []
-        
-        for order_data in orders_raw:
-            order_response = OrderResponse(
-                id_Pedido=order_data["id_Pedido"],
-                id_Pagamento=str(order_data.get("id_Pagamento")),
-                status_pedido=order_data.get("status_pedido"),
-                valor_total=order_data.get("valor"),
-                data_pedido=order_data.get("data_pedido"),
-                AvaliacaoFeita=order_data.get("AvaliacaoFeita", False)
-            )
-            
-            if include_qr_code:
-                order_response.qr_code = get_order_qr_code(order_data)
-            
-            if include_products:
-                order_response.produtos = get_order_products(order_response)
-            
-            order_list.append(order_response)
+        pedidos_dict_list, incomplete_orders = build_order_page(
+            response_orders["Items"], fields, include_products, include_qr_code, include_qr_code_image, context
+        )
         
         next_token = None
         if "LastEvaluatedKey" in response_orders:
             lek_serializable = convert_decimal_values(response_orders["LastEvaluatedKey"])
             next_token = json.dumps(lek_serializable, default=decimal_serializer)
         
-        pedidos_dict_list = [asdict(order) for order in order_list]
-
         response_body = {
             "pedidos": pedidos_dict_list
         }
+        if incomplete_orders:
+            response_body["parcial"] = True
         
         if next_token:
             response_body["nextToken"] = next_token
-        
+
+        print(f"Caches: {[cache.stats() for cache in CACHES]}")
+
         return {
             "statusCode": 200,
             "body": json.dumps(response_body, default=decimal_serializer)
@@ -398,6 +766,8 @@ if __name__ == "__main__":
     os.environ['BUCKET_NAME_PRODUCT'] = ''
     os.environ['BUCKET_NAME_STORE'] = ''
     os.environ['TABLE_STORE'] = ''
+    os.environ['BUCKET_NAME_QR_CODE'] = ''
+    os.environ['BUCKET_NAME_ORDER_EXPORT'] = ''
     event = {
         'queryStringParameters': {
             'cpf': ""
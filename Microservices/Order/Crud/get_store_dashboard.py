@@ -0,0 +1,71 @@
+import json
+import boto3
+import os
+import datetime
+from decimal import Decimal
+from zoneinfo import ZoneInfo
+
+
+def decimal_serializer(obj):
+    if isinstance(obj, Decimal):
+        return int(obj) if obj % 1 == 0 else float(obj)
+    raise TypeError(f"Object of type {type(obj)} is not JSON serializable")
+
+def build_dashboard_response(store_id: int, dashboard: dict):
+    today = datetime.datetime.now(ZoneInfo("America/Sao_Paulo")).strftime("%Y-%m-%d")
+
+    return {
+        'id_Loja': store_id,
+        'pedidos_por_status': {
+            attribute[len('qtd_'):]: quantidade
+            for attribute, quantidade in dashboard.items()
+            if attribute.startswith('qtd_') and quantidade
+        },
+        'faturamento_hoje': dashboard.get(f'faturamento_{today}', 0),
+        'atualizado_em': dashboard.get('atualizado_em')
+    }
+
+def lambda_handler(event: any, context: any):
+    try:
+        query_params = event.get('queryStringParameters', {}) or {}
+        store_id = query_params.get('id_Loja')
+
+        try:
+            store_id = int(store_id) if store_id else None
+        except ValueError:
+            print("ID da loja inválido.")
+            return {
+                "statusCode": 400,
+                "body": json.dumps({"message": "ID da loja inválido."})
+            }
+
+        if not store_id:
+            print("ID da loja não fornecido.")
+            return {
+                "statusCode": 400,
+                "body": json.dumps({"message": "ID da loja não fornecido."})
+            }
+
+        table_dashboard = boto3.resource('dynamodb').Table(os.environ['TABLE_STORE_DASHBOARD'])
+        dashboard = table_dashboard.get_item(Key={'id_Loja': store_id}).get('Item', {})
+
+        return {
+            "statusCode": 200,
+            "body": json.dumps(build_dashboard_response(store_id, dashboard), default=decimal_serializer)
+        }
+    except Exception as ex:
+        print(f"Erro ao buscar painel da loja: {str(ex)}")
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"message": f"Erro ao buscar painel da loja: {str(ex)}"})
+        }
+
+
+if __name__ == "__main__":
+    os.environ['TABLE_STORE_DASHBOARD'] = ''
+    event = {
+        "queryStringParameters": {
+            "id_Loja": ""
+        }
+    }
+    print(lambda_handler(event, None))
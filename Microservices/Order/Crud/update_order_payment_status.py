@@ -2,10 +2,129 @@ import json
 import boto3
 import os
 import datetime
+import time
+import threading
+import requests
 import mercadopago
+from collections import OrderedDict
+from mercadopago.http import HttpClient
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 from zoneinfo import ZoneInfo
 
 
+class TTLCache:
+    def __init__(self, namespace: str, max_size: int, ttl_seconds: float):
+        env_prefix = f"CACHE_{namespace.upper()}"
+        self.namespace = namespace
+        self.max_size = int(os.environ.get(f"{env_prefix}_MAX_SIZE", max_size))
+        self.ttl_seconds = float(os.environ.get(f"{env_prefix}_TTL_SECONDS", ttl_seconds))
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.items.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self.items[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self.items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.items[key] = (value, time.monotonic() + self.ttl_seconds)
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self.lock:
+            self.items.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+    def stats(self) -> dict:
+        return {
+            "namespace": self.namespace,
+            "size": len(self.items),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+
+STORE_CACHE = TTLCache('store', max_size=500, ttl_seconds=300)
+MP_SDK_CLIENTS = TTLCache('mp_sdk', max_size=100, ttl_seconds=900)
+
+MP_HTTP_POOL_SIZE = int(os.environ.get('MP_HTTP_POOL_SIZE', '10'))
+MP_HTTP_MAX_RETRIES = int(os.environ.get('MP_HTTP_MAX_RETRIES', '2'))
+MP_HTTP_SESSION = None
+MP_HTTP_SESSION_LOCK = threading.Lock()
+
+def get_mp_session():
+    global MP_HTTP_SESSION
+    with MP_HTTP_SESSION_LOCK:
+        if MP_HTTP_SESSION is None:
+            retry = Retry(total=MP_HTTP_MAX_RETRIES, status_forcelist=(429, 500, 502, 503, 504), backoff_factor=0.2)
+            adapter = HTTPAdapter(pool_connections=MP_HTTP_POOL_SIZE, pool_maxsize=MP_HTTP_POOL_SIZE, max_retries=retry)
+            session = requests.Session()
+            session.mount('https://', adapter)
+            MP_HTTP_SESSION = session
+    return MP_HTTP_SESSION
+
+class PooledHttpClient(HttpClient):
+    def request(self, method, url, maxretries=None, **kwargs):
+        kwargs.pop('retry_on', None)
+        kwargs.pop('backoff_factor', None)
+        api_result = get_mp_session().request(method, url, **kwargs)
+        response = {'status': api_result.status_code, 'response': None}
+
+        if api_result.status_code != 204 and api_result.content:
+            try:
+                response['response'] = api_result.json()
+            except ValueError:
+                print(f"Resposta inválida do Mercado Pago: {api_result.status_code}")
+        return response
+
+def get_mp_sdk(access_token: str):
+    sdk = MP_SDK_CLIENTS.get(access_token)
+    if sdk is None:
+        sdk = mercadopago.SDK(access_token, http_client=PooledHttpClient())
+        MP_SDK_CLIENTS.set(access_token, sdk)
+    return sdk
+
+def get_store(store_id):
+    cached = STORE_CACHE.get(str(store_id))
+    if cached is not None:
+        return cached
+
+    store = boto3.resource('dynamodb').Table(os.environ['TABLE_STORE']).get_item(Key={'id_Endereco': store_id}).get('Item')
+    if store is not None:
+        STORE_CACHE.set(str(store_id), store)
+    return store
+
+def invalidate_store(store_id, access_token: str = None):
+    STORE_CACHE.invalidate(str(store_id))
+    if access_token:
+        MP_SDK_CLIENTS.invalidate(access_token)
+
 MERCADO_PAGO_STATUS_MAP = {
     "pending": "Aguardando Pagamento",
     "approved": "Pago",
@@ -26,15 +145,73 @@ def refresh_status_pagamento(access_token: str, order: dict) -> None:
     if id_Pagamento is None:
         raise ValueError("id_Pagamento não encontrado no pedido")
     
-    sdk = mercadopago.SDK(access_token)
+    sdk = get_mp_sdk(access_token)
     payment = sdk.payment().get(id_Pagamento)
+    if payment['status'] == 401:
+        invalidate_store(order['fk_id_Endereco'], access_token)
     
     order['status_pedido'] = map_status_pagamento(payment['response']['status'])
+    order['status_data_pedido'] = f"{order['status_pedido']}#{order['data_pedido']}"
+    order['hora_atualizacao'] = datetime.datetime.now(ZoneInfo("America/Sao_Paulo")) .strftime("%Y-%m-%d %H:%M:%S")
     if order['status_pedido'] == "Pago":
         order['id_Transacao'] = payment['response']['transaction_details']['transaction_id']
+        order.setdefault('data_pagamento', order['hora_atualizacao'])
+    elif order['status_pedido'] in DASHBOARD_REVERSED_STATUSES:
+        order.setdefault('data_estorno', order['hora_atualizacao'])
 
-    order['hora_atualizacao'] = datetime.datetime.now(ZoneInfo("America/Sao_Paulo")) .strftime("%Y-%m-%d %H:%M:%S")
 
+DASHBOARD_PAID_STATUS = 'Pago'
+DASHBOARD_REVERSED_STATUSES = ('Reembolsado', 'Chargeback')
+
+def get_faturamento_em(old_order: dict, new_status: str, hora_atual: str):
+    if old_order.get('status_pedido') in DASHBOARD_REVERSED_STATUSES:
+        return None
+    if new_status == DASHBOARD_PAID_STATUS and not old_order.get('data_pagamento'):
+        return hora_atual[:10]
+    if new_status in DASHBOARD_REVERSED_STATUSES and old_order.get('data_pagamento') and not old_order.get('data_estorno'):
+        return old_order['data_pagamento'][:10]
+    return None
+
+def update_store_dashboard(store_id, old_status: str, new_status: str, valor, faturamento_em: str = None):
+    table_name = os.environ.get('TABLE_STORE_DASHBOARD')
+    if not table_name or store_id is None or old_status == new_status:
+        return
+
+    now = datetime.datetime.now(ZoneInfo("America/Sao_Paulo"))
+    add_expressions = []
+    attribute_names = {}
+    attribute_values = {':atualizado_em': now.strftime("%Y-%m-%d %H:%M:%S")}
+
+    if new_status:
+        add_expressions.append("#status_novo :um")
+        attribute_names['#status_novo'] = f"qtd_{new_status}"
+        attribute_values[':um'] = 1
+    if old_status:
+        add_expressions.append("#status_antigo :menos_um")
+        attribute_names['#status_antigo'] = f"qtd_{old_status}"
+        attribute_values[':menos_um'] = -1
+
+    revenue = None
+    if faturamento_em and valor is not None:
+        if new_status == DASHBOARD_PAID_STATUS:
+            revenue = valor
+        elif new_status in DASHBOARD_REVERSED_STATUSES:
+            revenue = -valor
+
+    if revenue is not None:
+        add_expressions.append("#faturamento :faturamento")
+        attribute_names['#faturamento'] = f"faturamento_{faturamento_em}"
+        attribute_values[':faturamento'] = revenue
+
+    try:
+        boto3.resource('dynamodb').Table(table_name).update_item(
+            Key={'id_Loja': store_id},
+            UpdateExpression="SET atualizado_em = :atualizado_em ADD " + ", ".join(add_expressions),
+            ExpressionAttributeNames=attribute_names,
+            ExpressionAttributeValues=attribute_values
+        )
+    except Exception as ex:
+        print(f"Erro ao atualizar painel da loja {store_id}: {str(ex)}")
 
 def lambda_handler(event:any, context:any): 
     try:
@@ -57,20 +234,21 @@ def lambda_handler(event:any, context:any):
 
         order = order['Item']
         store_id = order['fk_id_Endereco']
-        table_store = dynamoDB.Table(os.environ['TABLE_STORE'])
-        store = table_store.get_item(Key={'id_Endereco': store_id})
-        if 'Item' not in store:
+        store = get_store(store_id)
+        if store is None:
             return {
                 "statusCode": 404,
                 "body": json.dumps({f"Loja {store_id} não encontrada"}, default=str)
             }
-        
-        store = store['Item']
+
         access_token = store['access_token']
 
         refresh_status_pagamento(access_token, order)
 
-        table_order.put_item(Item=order)
+        response_put = table_order.put_item(Item=order, ReturnValues='ALL_OLD')
+        old_order = response_put.get('Attributes', {})
+        faturamento_em = get_faturamento_em(old_order, order['status_pedido'], order['hora_atualizacao'])
+        update_store_dashboard(store_id, old_order.get('status_pedido'), order['status_pedido'], order.get('valor'), faturamento_em)
 
         return {
             "statusCode": 200,
@@ -99,6 +277,7 @@ def lambda_handler(event:any, context:any):
 if __name__ == "__main__":
     os.environ['TABLE_ORDER'] = ''
     os.environ['TABLE_STORE'] = ''
+    os.environ['TABLE_STORE_DASHBOARD'] = ''
     event = {
         "body": json.dumps({
             "id_Pedido":""
@@ -0,0 +1,68 @@
+import json
+import boto3
+import os
+
+
+def get_status_data_pedido(order: dict):
+    if not order.get('status_pedido') or not order.get('data_pedido'):
+        return None
+    return f"{order['status_pedido']}#{order['data_pedido']}"
+
+def lambda_handler(event:any, context:any):
+    try:
+        table_order = boto3.resource('dynamodb').Table(os.environ['TABLE_ORDER'])
+
+        scan_params = {
+            'ProjectionExpression': 'id_Pedido, status_pedido, data_pedido, status_data_pedido'
+        }
+        total = 0
+        updated = 0
+        skipped = 0
+
+        done = False
+        while not done:
+            response = table_order.scan(**scan_params)
+
+            for order in response.get('Items', []):
+                total += 1
+                status_data_pedido = get_status_data_pedido(order)
+                if status_data_pedido is None or order.get('status_data_pedido') == status_data_pedido:
+                    skipped += 1
+                    continue
+
+                try:
+                    table_order.update_item(
+                        Key={'id_Pedido': order['id_Pedido']},
+                        UpdateExpression="set status_data_pedido = :status_data_pedido",
+                        ConditionExpression="status_pedido = :status_pedido",
+                        ExpressionAttributeValues={
+                            ':status_data_pedido': status_data_pedido,
+                            ':status_pedido': order['status_pedido']
+                        }
+                    )
+                    updated += 1
+                except table_order.meta.client.exceptions.ConditionalCheckFailedException:
+                    print(f"Status do pedido {order['id_Pedido']} alterado durante o backfill, ignorando")
+                    skipped += 1
+
+            start_key = response.get('LastEvaluatedKey', None)
+            if start_key:
+                scan_params['ExclusiveStartKey'] = start_key
+            done = start_key is None
+
+        print(f"Backfill concluído: {updated} pedidos atualizados de {total} ({skipped} ignorados)")
+        return {
+            'statusCode': 200,
+            'body': json.dumps({'total': total, 'atualizados': updated, 'ignorados': skipped}, default=str)
+        }
+    except Exception as ex:
+        print(f"Erro ao preencher status_data_pedido dos pedidos: {str(ex)}")
+        return {
+            'statusCode': 500,
+            'body': json.dumps({'message': 'Erro ao preencher status_data_pedido dos pedidos: ' + str(ex)}, default=str)
+        }
+
+
+if __name__ == "__main__":
+    os.environ['TABLE_ORDER'] = ''
+    print(lambda_handler({}, None))
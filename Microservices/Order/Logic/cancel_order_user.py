@@ -1,16 +1,150 @@
 import json
 import boto3
 import os
+import time
+import threading
 import requests
+from collections import OrderedDict
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 from datetime import datetime
 from zoneinfo import ZoneInfo
 import decimal
 
+class TTLCache:
+    def __init__(self, namespace: str, max_size: int, ttl_seconds: float):
+        env_prefix = f"CACHE_{namespace.upper()}"
+        self.namespace = namespace
+        self.max_size = int(os.environ.get(f"{env_prefix}_MAX_SIZE", max_size))
+        self.ttl_seconds = float(os.environ.get(f"{env_prefix}_TTL_SECONDS", ttl_seconds))
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.items.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self.items[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self.items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.items[key] = (value, time.monotonic() + self.ttl_seconds)
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self.lock:
+            self.items.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+    def stats(self) -> dict:
+        return {
+            "namespace": self.namespace,
+            "size": len(self.items),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+
+STORE_CACHE = TTLCache('store', max_size=500, ttl_seconds=300)
+
+MP_HTTP_POOL_SIZE = int(os.environ.get('MP_HTTP_POOL_SIZE', '10'))
+MP_HTTP_MAX_RETRIES = int(os.environ.get('MP_HTTP_MAX_RETRIES', '2'))
+MP_HTTP_SESSION = None
+MP_HTTP_SESSION_LOCK = threading.Lock()
+
+def get_mp_session():
+    global MP_HTTP_SESSION
+    with MP_HTTP_SESSION_LOCK:
+        if MP_HTTP_SESSION is None:
+            retry = Retry(total=MP_HTTP_MAX_RETRIES, status_forcelist=(429, 500, 502, 503, 504), backoff_factor=0.2)
+            adapter = HTTPAdapter(pool_connections=MP_HTTP_POOL_SIZE, pool_maxsize=MP_HTTP_POOL_SIZE, max_retries=retry)
+            session = requests.Session()
+            session.mount('https://', adapter)
+            MP_HTTP_SESSION = session
+    return MP_HTTP_SESSION
+
+def get_store(store_id):
+    cached = STORE_CACHE.get(str(store_id))
+    if cached is not None:
+        return cached
+
+    store = boto3.resource('dynamodb').Table(os.environ['STORE_ADDRESS_TABLE']).get_item(Key={'id_Endereco': store_id}).get('Item')
+    if store is not None:
+        STORE_CACHE.set(str(store_id), store)
+    return store
+
 def decimal_default(obj):
     if isinstance(obj, decimal.Decimal):
         return float(obj)
     raise TypeError(f"Tipo não serializável: {type(obj)}")
 
+DASHBOARD_PAID_STATUS = 'Pago'
+DASHBOARD_REVERSED_STATUSES = ('Reembolsado', 'Chargeback')
+
+def update_store_dashboard(store_id, old_status: str, new_status: str, valor, faturamento_em: str = None):
+    table_name = os.environ.get('TABLE_STORE_DASHBOARD')
+    if not table_name or store_id is None or old_status == new_status:
+        return
+
+    now = datetime.now(ZoneInfo("America/Sao_Paulo"))
+    add_expressions = []
+    attribute_names = {}
+    attribute_values = {':atualizado_em': now.strftime("%Y-%m-%d %H:%M:%S")}
+
+    if new_status:
+        add_expressions.append("#status_novo :um")
+        attribute_names['#status_novo'] = f"qtd_{new_status}"
+        attribute_values[':um'] = 1
+    if old_status:
+        add_expressions.append("#status_antigo :menos_um")
+        attribute_names['#status_antigo'] = f"qtd_{old_status}"
+        attribute_values[':menos_um'] = -1
+
+    revenue = None
+    if faturamento_em and valor is not None:
+        if new_status == DASHBOARD_PAID_STATUS:
+            revenue = valor
+        elif new_status in DASHBOARD_REVERSED_STATUSES:
+            revenue = -valor
+
+    if revenue is not None:
+        add_expressions.append("#faturamento :faturamento")
+        attribute_names['#faturamento'] = f"faturamento_{faturamento_em}"
+        attribute_values[':faturamento'] = revenue
+
+    try:
+        boto3.resource('dynamodb').Table(table_name).update_item(
+            Key={'id_Loja': store_id},
+            UpdateExpression="SET atualizado_em = :atualizado_em ADD " + ", ".join(add_expressions),
+            ExpressionAttributeNames=attribute_names,
+            ExpressionAttributeValues=attribute_values
+        )
+    except Exception as ex:
+        print(f"Erro ao atualizar painel da loja {store_id}: {str(ex)}")
+
 def lambda_handler(event, context):
     try:
         body = json.loads(event.get('body', '{}'))
@@ -52,19 +186,14 @@ def lambda_handler(event, context):
         
         id_loja = order['fk_id_Endereco']
         
-        table_store = dynamodb.Table(os.environ['STORE_ADDRESS_TABLE'])
-        response_store = table_store.get_item(
-            Key={'id_Endereco': id_loja}
-        )
+        store = get_store(id_loja)
         
-        if 'Item' not in response_store:
+        if store is None:
             return {
                 'statusCode': 404,
                 'body': json.dumps({'message': f'Loja com ID {id_loja} não encontrada'}, default=decimal_default)
             }
         
-        store = response_store['Item']
-        
         if 'access_token' not in store:
             return {
                 'statusCode': 400,
@@ -76,7 +205,7 @@ def lambda_handler(event, context):
         
         cancelable_statuses = ["in_process", "pending", "authorized"]
         
-        payment_status = get_payment_status(payment_id, access_token)
+        payment_status = get_payment_status(payment_id, access_token, id_loja)
         
         if payment_status and payment_status not in cancelable_statuses:
             return {
@@ -86,19 +215,24 @@ def lambda_handler(event, context):
                 }, default=decimal_default)
             }
         
-        cancel_result = cancel_payment(payment_id, access_token)
+        access_token = (get_store(id_loja) or store).get('access_token') or access_token
+        cancel_result = cancel_payment(payment_id, access_token, id_loja)
         
         if cancel_result.get('status') == 'cancelled':
             hora_atual = datetime.now(ZoneInfo("America/Sao_Paulo")).strftime("%Y-%m-%d %H:%M:%S")
             
-            table_order.update_item(
+            response_update = table_order.update_item(
                 Key={'id_Pedido': id_pedido},
-                UpdateExpression="set status_pedido = :status, hora_atualizacao = :hora",
+                UpdateExpression="set status_pedido = :status, status_data_pedido = :status_data, hora_atualizacao = :hora",
                 ExpressionAttributeValues={
                     ':status': 'Cancelado',
+                    ':status_data': f"Cancelado#{order['data_pedido']}",
                     ':hora': hora_atual
-                }
+                },
+                ReturnValues='UPDATED_OLD'
             )
+            old_status = response_update.get('Attributes', {}).get('status_pedido', order.get('status_pedido'))
+            update_store_dashboard(id_loja, old_status, 'Cancelado', order.get('valor'))
             
             return {
                 'statusCode': 200,
@@ -128,7 +262,15 @@ def lambda_handler(event, context):
             'body': json.dumps({'message': f'Erro ao cancelar pedido: {str(ex)}'}, default=decimal_default)
         }
 
-def get_payment_status(payment_id, access_token):
+def refresh_access_token(store_id, access_token):
+    STORE_CACHE.invalidate(str(store_id))
+    store = get_store(store_id)
+    new_access_token = store.get('access_token') if store else None
+    if new_access_token and new_access_token != access_token:
+        return new_access_token
+    return None
+
+def get_payment_status(payment_id, access_token, store_id=None):
     try:
         url = f"https://api.mercadopago.com/v1/payments/{payment_id}"
         headers = {
@@ -136,7 +278,12 @@ def get_payment_status(payment_id, access_token):
             "Content-Type": "application/json"
         }
         
-        response = requests.get(url, headers=headers)
+        response = get_mp_session().get(url, headers=headers, timeout=10)
+        
+        if response.status_code == 401 and store_id is not None:
+            new_access_token = refresh_access_token(store_id, access_token)
+            if new_access_token:
+                return get_payment_status(payment_id, new_access_token)
         
         if response.status_code == 200:
             payment_data = response.json()
@@ -148,7 +295,7 @@ def get_payment_status(payment_id, access_token):
         print(f"Erro ao consultar status do pagamento: {ex}")
         return None
 
-def cancel_payment(payment_id, access_token):
+def cancel_payment(payment_id, access_token, store_id=None):
     try:
         url = f"https://api.mercadopago.com/v1/payments/{payment_id}"
         headers = {
@@ -159,7 +306,12 @@ def cancel_payment(payment_id, access_token):
             "status": "cancelled"
         }
         
-        response = requests.put(url, headers=headers, json=payload)
+        response = get_mp_session().put(url, headers=headers, json=payload, timeout=15)
+        
+        if response.status_code == 401 and store_id is not None:
+            new_access_token = refresh_access_token(store_id, access_token)
+            if new_access_token:
+                return cancel_payment(payment_id, new_access_token)
         
         if response.status_code == 200:
             return response.json()
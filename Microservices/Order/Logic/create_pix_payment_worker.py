@@ -0,0 +1,354 @@
+import json
+import boto3
+import base64
+import os
+import datetime
+import time
+import threading
+import requests
+import mercadopago
+from collections import OrderedDict
+from mercadopago.http import HttpClient
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+from zoneinfo import ZoneInfo
+
+PIX_PAYMENT_CREATING_STATUS = 'Criando Pagamento'
+PIX_PAYMENT_CREATED_STATUS = 'Aguardando Pagamento'
+PIX_PAYMENT_FAILED_STATUS = 'Falha no Pagamento'
+
+DASHBOARD_PAID_STATUS = 'Pago'
+DASHBOARD_REVERSED_STATUSES = ('Reembolsado', 'Chargeback')
+
+dynamodb = boto3.resource('dynamodb')
+
+class TTLCache:
+    def __init__(self, namespace: str, max_size: int, ttl_seconds: float):
+        env_prefix = f"CACHE_{namespace.upper()}"
+        self.namespace = namespace
+        self.max_size = int(os.environ.get(f"{env_prefix}_MAX_SIZE", max_size))
+        self.ttl_seconds = float(os.environ.get(f"{env_prefix}_TTL_SECONDS", ttl_seconds))
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.items.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self.items[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self.items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.items[key] = (value, time.monotonic() + self.ttl_seconds)
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self.lock:
+            self.items.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+    def stats(self) -> dict:
+        return {
+            "namespace": self.namespace,
+            "size": len(self.items),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+
+STORE_CACHE = TTLCache('store', max_size=500, ttl_seconds=300)
+MP_SDK_CLIENTS = TTLCache('mp_sdk', max_size=100, ttl_seconds=900)
+
+MP_HTTP_POOL_SIZE = int(os.environ.get('MP_HTTP_POOL_SIZE', '10'))
+MP_HTTP_MAX_RETRIES = int(os.environ.get('MP_HTTP_MAX_RETRIES', '2'))
+MP_HTTP_SESSION = None
+MP_HTTP_SESSION_LOCK = threading.Lock()
+
+def get_mp_session():
+    global MP_HTTP_SESSION
+    with MP_HTTP_SESSION_LOCK:
+        if MP_HTTP_SESSION is None:
+            retry = Retry(total=MP_HTTP_MAX_RETRIES, status_forcelist=(429, 500, 502, 503, 504), backoff_factor=0.2)
+            adapter = HTTPAdapter(pool_connections=MP_HTTP_POOL_SIZE, pool_maxsize=MP_HTTP_POOL_SIZE, max_retries=retry)
+            session = requests.Session()
+            session.mount('https://', adapter)
+            MP_HTTP_SESSION = session
+    return MP_HTTP_SESSION
+
+class PooledHttpClient(HttpClient):
+    def request(self, method, url, maxretries=None, **kwargs):
+        kwargs.pop('retry_on', None)
+        kwargs.pop('backoff_factor', None)
+        api_result = get_mp_session().request(method, url, **kwargs)
+        response = {'status': api_result.status_code, 'response': None}
+
+        if api_result.status_code != 204 and api_result.content:
+            try:
+                response['response'] = api_result.json()
+            except ValueError:
+                print(f"Resposta inválida do Mercado Pago: {api_result.status_code}")
+        return response
+
+def get_mp_sdk(access_token: str):
+    sdk = MP_SDK_CLIENTS.get(access_token)
+    if sdk is None:
+        sdk = mercadopago.SDK(access_token, http_client=PooledHttpClient())
+        MP_SDK_CLIENTS.set(access_token, sdk)
+    return sdk
+
+def get_store(store_id):
+    cached = STORE_CACHE.get(str(store_id))
+    if cached is not None:
+        return cached
+
+    store = dynamodb.Table(os.environ['STORE_ADDRESS_TABLE']).get_item(Key={'id_Endereco': store_id}).get('Item')
+    if store is not None:
+        STORE_CACHE.set(str(store_id), store)
+    return store
+
+def invalidate_store(store_id, access_token: str = None):
+    STORE_CACHE.invalidate(str(store_id))
+    if access_token:
+        MP_SDK_CLIENTS.invalidate(access_token)
+
+def update_store_dashboard(store_id, old_status: str, new_status: str, valor, faturamento_em: str = None):
+    table_name = os.environ.get('TABLE_STORE_DASHBOARD')
+    if not table_name or store_id is None or old_status == new_status:
+        return
+
+    now = datetime.datetime.now(ZoneInfo("America/Sao_Paulo"))
+    add_expressions = []
+    attribute_names = {}
+    attribute_values = {':atualizado_em': now.strftime("%Y-%m-%d %H:%M:%S")}
+
+    if new_status:
+        add_expressions.append("#status_novo :um")
+        attribute_names['#status_novo'] = f"qtd_{new_status}"
+        attribute_values[':um'] = 1
+    if old_status:
+        add_expressions.append("#status_antigo :menos_um")
+        attribute_names['#status_antigo'] = f"qtd_{old_status}"
+        attribute_values[':menos_um'] = -1
+
+    revenue = None
+    if faturamento_em and valor is not None:
+        if new_status == DASHBOARD_PAID_STATUS:
+            revenue = valor
+        elif new_status in DASHBOARD_REVERSED_STATUSES:
+            revenue = -valor
+
+    if revenue is not None:
+        add_expressions.append("#faturamento :faturamento")
+        attribute_names['#faturamento'] = f"faturamento_{faturamento_em}"
+        attribute_values[':faturamento'] = revenue
+
+    try:
+        dynamodb.Table(table_name).update_item(
+            Key={'id_Loja': store_id},
+            UpdateExpression="SET atualizado_em = :atualizado_em ADD " + ", ".join(add_expressions),
+            ExpressionAttributeNames=attribute_names,
+            ExpressionAttributeValues=attribute_values
+        )
+    except Exception as ex:
+        print(f"Erro ao atualizar painel da loja {store_id}: {str(ex)}")
+
+def get_order_items(order_id: str):
+    table_item_order = dynamodb.Table(os.environ['TABLE_ITEM_ORDER'])
+    items = []
+    query_params = {
+        'IndexName': 'fk_id_Pedido-index',
+        'KeyConditionExpression': Key('fk_id_Pedido').eq(order_id)
+    }
+    while True:
+        response = table_item_order.query(**query_params)
+        items.extend(response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            return items
+        query_params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def create_pix_payment(order: dict, items: list, email: str, access_token: str):
+    sdk = get_mp_sdk(access_token)
+    request_options = mercadopago.config.RequestOptions()
+    request_options.custom_headers = {
+        'x-idempotency-key': order['id_Pedido']
+    }
+
+    payment_data = {
+        "transaction_amount": float(order['valor']),
+        "payment_method_id": "pix",
+        "payer": {
+            "email": email,
+        },
+        "description": "Pedido Vizinhos",
+        "additional_info": {
+            "items": [
+                {
+                    "id": item['fk_id_Pedido'],
+                    "title": item['fk_id_Lote'],
+                    "quantity": int(item['quantidade_item']),
+                    "unit_price": float(item['preco_unitario'])
+                } for item in items
+            ]
+        },
+    }
+    return sdk.payment().create(payment_data, request_options)
+
+def save_qr_code_image(order_id: str, qr_code_base64: str):
+    bucket_name = os.environ.get('BUCKET_NAME_QR_CODE')
+    if not bucket_name or not qr_code_base64:
+        return None
+
+    try:
+        file_name = f"{order_id}.png"
+        boto3.client('s3').put_object(
+            Bucket=bucket_name,
+            Key=file_name,
+            Body=base64.b64decode(qr_code_base64),
+            ContentType='image/png',
+            ACL='public-read'
+        )
+        return file_name
+    except Exception as ex:
+        print(f"Erro ao salvar imagem do QR code do pedido {order_id}: {str(ex)}")
+        return None
+
+def set_order_status(order: dict, new_status: str, extra_values: dict):
+    hora_atual = datetime.datetime.now(ZoneInfo("America/Sao_Paulo")).strftime("%Y-%m-%d %H:%M:%S")
+    set_expressions = ["status_pedido = :status_novo", "status_data_pedido = :status_data_pedido", "hora_atualizacao = :hora"]
+    expression_values = {
+        ':status_novo': new_status,
+        ':status_atual': PIX_PAYMENT_CREATING_STATUS,
+        ':status_data_pedido': f"{new_status}#{order['data_pedido']}",
+        ':hora': hora_atual
+    }
+    for attribute, value in extra_values.items():
+        set_expressions.append(f"{attribute} = :{attribute}")
+        expression_values[f':{attribute}'] = value
+
+    return {
+        'TableName': os.environ['TABLE_ORDER'],
+        'Key': {'id_Pedido': order['id_Pedido']},
+        'UpdateExpression': "set " + ", ".join(set_expressions),
+        'ConditionExpression': "status_pedido = :status_atual",
+        'ExpressionAttributeValues': expression_values
+    }
+
+def fail_order(order: dict, items: list, reason: str):
+    actions = [{'Update': set_order_status(order, PIX_PAYMENT_FAILED_STATUS, {'motivo_falha': reason})}]
+    for item in items:
+        actions.append({
+            'Update': {
+                'TableName': os.environ['TABLE_LOTE'],
+                'Key': {'id_Lote': item['fk_id_Lote']},
+                'UpdateExpression': 'SET quantidade = quantidade + :quantidade',
+                'ExpressionAttributeValues': {':quantidade': item['quantidade_item']}
+            }
+        })
+
+    dynamodb.meta.client.transact_write_items(TransactItems=actions)
+    update_store_dashboard(order.get('fk_id_Endereco'), PIX_PAYMENT_CREATING_STATUS, PIX_PAYMENT_FAILED_STATUS, order.get('valor'))
+
+def process_pix_payment(order_id: str):
+    table_order = dynamodb.Table(os.environ['TABLE_ORDER'])
+    order = table_order.get_item(Key={'id_Pedido': order_id}, ConsistentRead=True).get('Item')
+    if order is None:
+        print(f"Pedido {order_id} não encontrado, mensagem descartada")
+        return
+    if order.get('status_pedido') != PIX_PAYMENT_CREATING_STATUS:
+        print(f"Pagamento do pedido {order_id} já processado (status {order.get('status_pedido')})")
+        return
+
+    items = get_order_items(order_id)
+
+    user = dynamodb.Table(os.environ['TABLE_USER']).get_item(Key={'cpf': order['fk_Usuario_cpf']}).get('Item')
+    store = get_store(order['fk_id_Endereco'])
+    if user is None or store is None or not store.get('access_token'):
+        print(f"Usuário ou loja do pedido {order_id} inválidos, liberando estoque")
+        fail_order(order, items, 'Usuário ou loja inválidos')
+        return
+
+    payment = create_pix_payment(order, items, user['email'], store['access_token'])
+    payment_response = payment['response']
+    if payment['status'] == 401:
+        invalidate_store(order['fk_id_Endereco'], store['access_token'])
+    if payment['status'] == 429 or payment['status'] >= 500:
+        raise Exception(f"Erro temporário do Mercado Pago ({payment['status']}) ao criar pagamento do pedido {order_id}")
+    if payment['status'] != 201:
+        print(f"Erro ao criar pagamento do pedido {order_id}: {payment_response.get('message')}")
+        fail_order(order, items, f"Erro ao criar pagamento: {payment_response.get('message')}")
+        return
+
+    transaction_data = payment_response['point_of_interaction']['transaction_data']
+    qr_code_image_id = save_qr_code_image(order_id, transaction_data.get('qr_code_base64'))
+
+    update = set_order_status(order, PIX_PAYMENT_CREATED_STATUS, {
+        'id_Pagamento': payment_response['id'],
+        'qr_code': transaction_data.get('qr_code'),
+        'id_Imagem_QR_Code': qr_code_image_id
+    })
+    try:
+        dynamodb.meta.client.update_item(**update)
+    except ClientError as err:
+        if err.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        print(f"Pedido {order_id} alterado durante a criação do pagamento")
+        return
+
+    update_store_dashboard(order.get('fk_id_Endereco'), PIX_PAYMENT_CREATING_STATUS, PIX_PAYMENT_CREATED_STATUS, order.get('valor'))
+    print(f"Pagamento {payment_response['id']} criado para o pedido {order_id}")
+
+def lambda_handler(event:any, context:any):
+    failures = []
+    for record in event.get('Records', []):
+        try:
+            order_id = json.loads(record['body'])['id_Pedido']
+            process_pix_payment(order_id)
+        except Exception as ex:
+            print(f"Erro ao processar mensagem {record.get('messageId')}: {str(ex)}")
+            failures.append({'itemIdentifier': record.get('messageId')})
+
+    return {'batchItemFailures': failures}
+
+
+if __name__ == "__main__":
+    os.environ['TABLE_ORDER'] = ''
+    os.environ['TABLE_ITEM_ORDER'] = ''
+    os.environ['TABLE_USER'] = ''
+    os.environ['TABLE_LOTE'] = ''
+    os.environ['STORE_ADDRESS_TABLE'] = ''
+    os.environ['BUCKET_NAME_QR_CODE'] = ''
+    os.environ['TABLE_STORE_DASHBOARD'] = ''
+    event = {
+        "Records": [
+            {
+                "messageId": "",
+                "body": json.dumps({"id_Pedido": ""})
+            }
+        ]
+    }
+    print(lambda_handler(event, None))
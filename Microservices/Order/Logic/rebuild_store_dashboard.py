@@ -0,0 +1,99 @@
+import json
+import boto3
+import os
+import datetime
+from zoneinfo import ZoneInfo
+
+DASHBOARD_PAID_STATUS = 'Pago'
+DASHBOARD_REVERSED_STATUSES = ('Reembolsado', 'Chargeback')
+
+def get_faturamento_em(order: dict):
+    if order.get('data_estorno') or order.get('status_pedido') in DASHBOARD_REVERSED_STATUSES:
+        return None
+    if order.get('data_pagamento'):
+        return order['data_pagamento'][:10]
+    if order.get('status_pedido') == DASHBOARD_PAID_STATUS and order.get('hora_atualizacao'):
+        return order['hora_atualizacao'][:10]
+    return None
+
+def get_dashboard_store_ids(table_dashboard) -> set:
+    scan_params = {'ProjectionExpression': 'id_Loja'}
+    store_ids = set()
+
+    done = False
+    while not done:
+        response = table_dashboard.scan(**scan_params)
+        store_ids.update(dashboard['id_Loja'] for dashboard in response.get('Items', []))
+
+        start_key = response.get('LastEvaluatedKey', None)
+        if start_key:
+            scan_params['ExclusiveStartKey'] = start_key
+        done = start_key is None
+
+    return store_ids
+
+def lambda_handler(event:any, context:any):
+    try:
+        dynamodb = boto3.resource('dynamodb')
+        table_order = dynamodb.Table(os.environ['TABLE_ORDER'])
+        table_dashboard = dynamodb.Table(os.environ['TABLE_STORE_DASHBOARD'])
+
+        now = datetime.datetime.now(ZoneInfo("America/Sao_Paulo"))
+        today = now.strftime("%Y-%m-%d")
+        existing_store_ids = get_dashboard_store_ids(table_dashboard)
+
+        scan_params = {
+            'ProjectionExpression': 'fk_id_Endereco, status_pedido, valor, hora_atualizacao, data_pagamento, data_estorno'
+        }
+        dashboards = {}
+        total = 0
+
+        done = False
+        while not done:
+            response = table_order.scan(**scan_params)
+
+            for order in response.get('Items', []):
+                store_id = order.get('fk_id_Endereco')
+                status = order.get('status_pedido')
+                if store_id is None or not status:
+                    continue
+
+                total += 1
+                dashboard = dashboards.setdefault(store_id, {'id_Loja': store_id, f'faturamento_{today}': 0})
+                dashboard[f'qtd_{status}'] = dashboard.get(f'qtd_{status}', 0) + 1
+
+                faturamento_em = get_faturamento_em(order)
+                if faturamento_em:
+                    dashboard[f'faturamento_{faturamento_em}'] = dashboard.get(f'faturamento_{faturamento_em}', 0) + order.get('valor', 0)
+
+            start_key = response.get('LastEvaluatedKey', None)
+            if start_key:
+                scan_params['ExclusiveStartKey'] = start_key
+            done = start_key is None
+
+        with table_dashboard.batch_writer() as batch:
+            for dashboard in dashboards.values():
+                dashboard['atualizado_em'] = now.strftime("%Y-%m-%d %H:%M:%S")
+                batch.put_item(Item=dashboard)
+
+            stale_store_ids = existing_store_ids - dashboards.keys()
+            for store_id in stale_store_ids:
+                batch.delete_item(Key={'id_Loja': store_id})
+
+        print(f"Painel recalculado para {len(dashboards)} lojas a partir de {total} pedidos ({len(stale_store_ids)} lojas sem pedidos removidas)")
+        return {
+            'statusCode': 200,
+            'body': json.dumps({'lojas': len(dashboards), 'pedidos': total, 'removidas': len(stale_store_ids)})
+        }
+    except Exception as ex:
+        print(f"Erro ao recalcular painel das lojas: {str(ex)}")
+        return {
+            'statusCode': 500,
+            'body': json.dumps({'message': 'Erro ao recalcular painel das lojas: ' + str(ex)}, default=str)
+        }
+
+
+if __name__ == "__main__":
+    os.environ['TABLE_ORDER'] = ''
+    os.environ['TABLE_STORE_DASHBOARD'] = ''
+    print(lambda_handler({}, None))
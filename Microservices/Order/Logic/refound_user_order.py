@@ -1,25 +1,122 @@
 # -*- coding: utf-8 -*-
 import json
 import os
+import time
+import threading
 import requests
+from collections import OrderedDict
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 import boto3
 from datetime import datetime
 from zoneinfo import ZoneInfo
 import decimal
 import uuid
 
-session = requests.Session()
 dynamodb = boto3.resource("dynamodb")
 
 TABLE_ORDER_NAME = os.environ.get("TABLE_ORDER")
 STORE_ADDRESS_TABLE_NAME = os.environ.get("STORE_ADDRESS_TABLE")
 
+class TTLCache:
+    def __init__(self, namespace: str, max_size: int, ttl_seconds: float):
+        env_prefix = f"CACHE_{namespace.upper()}"
+        self.namespace = namespace
+        self.max_size = int(os.environ.get(f"{env_prefix}_MAX_SIZE", max_size))
+        self.ttl_seconds = float(os.environ.get(f"{env_prefix}_TTL_SECONDS", ttl_seconds))
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.items.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self.items[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self.items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.items[key] = (value, time.monotonic() + self.ttl_seconds)
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self.lock:
+            self.items.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+    def stats(self) -> dict:
+        return {
+            "namespace": self.namespace,
+            "size": len(self.items),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+
+STORE_CACHE = TTLCache('store', max_size=500, ttl_seconds=300)
+
+MP_HTTP_POOL_SIZE = int(os.environ.get('MP_HTTP_POOL_SIZE', '10'))
+MP_HTTP_MAX_RETRIES = int(os.environ.get('MP_HTTP_MAX_RETRIES', '2'))
+MP_HTTP_SESSION = None
+MP_HTTP_SESSION_LOCK = threading.Lock()
+
+def get_mp_session():
+    global MP_HTTP_SESSION
+    with MP_HTTP_SESSION_LOCK:
+        if MP_HTTP_SESSION is None:
+            retry = Retry(total=MP_HTTP_MAX_RETRIES, status_forcelist=(429, 500, 502, 503, 504), backoff_factor=0.2)
+            adapter = HTTPAdapter(pool_connections=MP_HTTP_POOL_SIZE, pool_maxsize=MP_HTTP_POOL_SIZE, max_retries=retry)
+            session = requests.Session()
+            session.mount('https://', adapter)
+            MP_HTTP_SESSION = session
+    return MP_HTTP_SESSION
+
+def get_store(store_id):
+    cached = STORE_CACHE.get(str(store_id))
+    if cached is not None:
+        return cached
+
+    store = dynamodb.Table(STORE_ADDRESS_TABLE_NAME).get_item(Key={'id_Endereco': store_id}).get('Item')
+    if store is not None:
+        STORE_CACHE.set(str(store_id), store)
+    return store
+
 def decimal_default(obj):
     if isinstance(obj, decimal.Decimal):
         return float(obj)
     raise TypeError(f"Tipo não serializável: {type(obj)}")
 
-def get_payment_status(payment_id, access_token):
+def refresh_access_token(store_id, access_token):
+    STORE_CACHE.invalidate(str(store_id))
+    store = get_store(store_id)
+    new_access_token = store.get("access_token") if store else None
+    if new_access_token and new_access_token != access_token:
+        return new_access_token
+    return None
+
+def get_payment_status(payment_id, access_token, store_id=None):
     try:
         payment_id_str = str(payment_id)
         url = f"https://api.mercadopago.com/v1/payments/{payment_id_str}"
@@ -28,7 +125,11 @@ def get_payment_status(payment_id, access_token):
             "Accept": "application/json"
         }
         print(f"Consultando status do pagamento {payment_id_str}...")
-        response = session.get(url, headers=headers, timeout=10)
+        response = get_mp_session().get(url, headers=headers, timeout=10)
+        if response.status_code == 401 and store_id is not None:
+            new_access_token = refresh_access_token(store_id, access_token)
+            if new_access_token:
+                return get_payment_status(payment_id, new_access_token)
         response.raise_for_status()
 
         payment_data = response.json()
@@ -49,7 +150,7 @@ def get_payment_status(payment_id, access_token):
         print(error_message)
         return None
 
-def refund_total_payment(payment_id, access_token):
+def refund_total_payment(payment_id, access_token, store_id=None):
     try:
         payment_id_str = str(payment_id)
         url = f"https://api.mercadopago.com/v1/payments/{payment_id_str}/refunds"
@@ -60,7 +161,12 @@ def refund_total_payment(payment_id, access_token):
         }
         payload = None
         print(f"Iniciando reembolso TOTAL para o pagamento {payment_id_str}...")
-        response = session.post(url, headers=headers, json=payload, timeout=15)
+        response = get_mp_session().post(url, headers=headers, json=payload, timeout=15)
+
+        if response.status_code == 401 and store_id is not None:
+            new_access_token = refresh_access_token(store_id, access_token)
+            if new_access_token:
+                return refund_total_payment(payment_id, new_access_token)
 
         if response.status_code == 423:
             error_message = f"Erro 423: Recurso bloqueado. Tentativa de reembolso recente para {payment_id_str}. {response.text}"
@@ -95,6 +201,59 @@ def refund_total_payment(payment_id, access_token):
         print(error_message)
         return {"error": error_message}
 
+DASHBOARD_PAID_STATUS = 'Pago'
+DASHBOARD_REVERSED_STATUSES = ('Reembolsado', 'Chargeback')
+
+def get_faturamento_em(old_order: dict, new_status: str, hora_atual: str):
+    if old_order.get('status_pedido') in DASHBOARD_REVERSED_STATUSES:
+        return None
+    if new_status == DASHBOARD_PAID_STATUS and not old_order.get('data_pagamento'):
+        return hora_atual[:10]
+    if new_status in DASHBOARD_REVERSED_STATUSES and old_order.get('data_pagamento') and not old_order.get('data_estorno'):
+        return old_order['data_pagamento'][:10]
+    return None
+
+def update_store_dashboard(store_id, old_status: str, new_status: str, valor, faturamento_em: str = None):
+    table_name = os.environ.get('TABLE_STORE_DASHBOARD')
+    if not table_name or store_id is None or old_status == new_status:
+        return
+
+    now = datetime.now(ZoneInfo("America/Sao_Paulo"))
+    add_expressions = []
+    attribute_names = {}
+    attribute_values = {':atualizado_em': now.strftime("%Y-%m-%d %H:%M:%S")}
+
+    if new_status:
+        add_expressions.append("#status_novo :um")
+        attribute_names['#status_novo'] = f"qtd_{new_status}"
+        attribute_values[':um'] = 1
+    if old_status:
+        add_expressions.append("#status_antigo :menos_um")
+        attribute_names['#status_antigo'] = f"qtd_{old_status}"
+        attribute_values[':menos_um'] = -1
+
+    revenue = None
+    if faturamento_em and valor is not None:
+        if new_status == DASHBOARD_PAID_STATUS:
+            revenue = valor
+        elif new_status in DASHBOARD_REVERSED_STATUSES:
+            revenue = -valor
+
+    if revenue is not None:
+        add_expressions.append("#faturamento :faturamento")
+        attribute_names['#faturamento'] = f"faturamento_{faturamento_em}"
+        attribute_values[':faturamento'] = revenue
+
+    try:
+        dynamodb.Table(table_name).update_item(
+            Key={'id_Loja': store_id},
+            UpdateExpression="SET atualizado_em = :atualizado_em ADD " + ", ".join(add_expressions),
+            ExpressionAttributeNames=attribute_names,
+            ExpressionAttributeValues=attribute_values
+        )
+    except Exception as ex:
+        print(f"Erro ao atualizar painel da loja {store_id}: {str(ex)}")
+
 def lambda_handler(event, context):
     payment_id_for_logging = None
     id_pedido_for_logging = None
@@ -107,7 +266,6 @@ def lambda_handler(event, context):
             }
         
         table_order = dynamodb.Table(TABLE_ORDER_NAME)
-        table_store = dynamodb.Table(STORE_ADDRESS_TABLE_NAME)
 
         try:
             body = json.loads(event.get("body", "{}"))
@@ -133,16 +291,15 @@ def lambda_handler(event, context):
         if not id_loja: return {"statusCode": 400, "body": json.dumps({"message": "Pedido não possui ID da loja (fk_id_Endereco)."}, default=decimal_default)}
 
         try:
-            response_store = table_store.get_item(Key={"id_Endereco": id_loja})
+            store = get_store(id_loja)
         except Exception as db_ex:
              print(f"Erro ao acessar DynamoDB (Store Table): {db_ex}")
              return {"statusCode": 500, "body": json.dumps({"message": f"Erro ao buscar loja no DynamoDB: {str(db_ex)}"}, default=decimal_default)}
-        if "Item" not in response_store: return {"statusCode": 404, "body": json.dumps({"message": f"Loja com ID {id_loja} não encontrada."}, default=decimal_default)}
-        store = response_store["Item"]
+        if store is None: return {"statusCode": 404, "body": json.dumps({"message": f"Loja com ID {id_loja} não encontrada."}, default=decimal_default)}
         access_token = store.get("access_token")
         if not access_token: return {"statusCode": 400, "body": json.dumps({"message": "Loja não possui token de acesso do Mercado Pago (access_token)."}, default=decimal_default)}
 
-        current_payment_status = get_payment_status(payment_id, access_token)
+        current_payment_status = get_payment_status(payment_id, access_token, id_loja)
         if current_payment_status is None:
             return {
                 "statusCode": 503,
@@ -160,7 +317,8 @@ def lambda_handler(event, context):
                 }, default=decimal_default)
             }
 
-        refund_result = refund_total_payment(payment_id, access_token)
+        access_token = (get_store(id_loja) or store).get("access_token") or access_token
+        refund_result = refund_total_payment(payment_id, access_token, id_loja)
 
         if isinstance(refund_result, dict) and refund_result.get("error_locked"):
             return {
@@ -196,17 +354,25 @@ def lambda_handler(event, context):
         try:
             novo_status_pedido = 'Reembolsado'
             id_reembolso_mp = refund_result.get('id')
-            update_expression = "set status_pedido = :status, hora_atualizacao = :hora"
-            expression_values = {':status': novo_status_pedido, ':hora': hora_atual}
+            update_expression = "set status_pedido = :status, status_data_pedido = :status_data, hora_atualizacao = :hora, data_estorno = if_not_exists(data_estorno, :hora)"
+            expression_values = {
+                ':status': novo_status_pedido,
+                ':status_data': f"{novo_status_pedido}#{order['data_pedido']}",
+                ':hora': hora_atual
+            }
             if id_reembolso_mp:
                 update_expression += ", id_reembolso = :reembolso_id"
                 expression_values[':reembolso_id'] = id_reembolso_mp
             
-            table_order.update_item(
+            response_update = table_order.update_item(
                 Key={'id_Pedido': id_pedido},
                 UpdateExpression=update_expression,
-                ExpressionAttributeValues=expression_values
+                ExpressionAttributeValues=expression_values,
+                ReturnValues='ALL_OLD'
             )
+            old_order = response_update.get('Attributes', order)
+            faturamento_em = get_faturamento_em(old_order, novo_status_pedido, hora_atual)
+            update_store_dashboard(id_loja, old_order.get('status_pedido'), novo_status_pedido, order.get('valor'), faturamento_em)
             print(f"Status do pedido {id_pedido} atualizado para {novo_status_pedido} no DynamoDB.")
         except Exception as update_ex:
             print(f"AVISO: Falha ao atualizar status do pedido {id_pedido} no DynamoDB após reembolso bem-sucedido: {update_ex}")